@@ -0,0 +1,209 @@
+"""
+End-to-end load benchmark
+Runs the real application (polling, handlers, dispatcher) against the local stand-in Bot API:
+a session-open posting burst, a /report over a large session and a /clear of a busy topic.
+Each scenario runs under the bot's real outbound limits and with the limits lifted
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import random
+import resource
+import sys
+import time
+from array import array
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_api import FakeBotAPI, message_update
+
+TOKEN = "123456:BENCH"
+ADMIN_ID = 1
+UNLIMITED = 100000.0
+
+
+def percentile(samples, p):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def summarize(name, limits, latencies, elapsed, count, unit):
+    row = {
+        "scenario": name,
+        "limits": limits,
+        "count": count,
+        "elapsed_s": round(elapsed, 3),
+        f"{unit}_per_s": round(count / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+    print(
+        f"{name:<8} {limits:<9} {count:>7} {unit:<8} {row['elapsed_s']:>8.2f}s {row[f'{unit}_per_s']:>9.1f}/s "
+        f"p50 {row['p50_ms']:>8.1f}ms  p99 {row['p99_ms']:>8.1f}ms  rss {row['peak_rss_mb']:>7.1f}MB"
+    )
+    return row
+
+
+async def wait_until(cond, timeout):
+    deadline = time.perf_counter() + timeout
+    while not cond():
+        if time.perf_counter() > deadline:
+            raise TimeoutError("scenario did not finish")
+        await asyncio.sleep(0.005)
+
+
+def set_limits(bot, global_rate, global_burst, chat_rate, chat_burst):
+    """Swap the dispatcher's buckets in place (the bot reads its limits from env at import)"""
+    bot.CHAT_RATE, bot.CHAT_BURST = chat_rate, chat_burst
+    bot.dispatcher.global_bucket = bot.TokenBucket(global_rate, global_burst)
+    bot.dispatcher.chat_buckets.clear()
+
+
+async def burst(api, bot, limits, users, timeout):
+    """Session-open burst: one link per user; done when the repost and the delete both landed"""
+    bot._clear_session()
+    bot.session_open = True
+    base = 1_000_000
+    pending = {}  # original message id -> [update_id, calls still expected]
+    latencies = []
+
+    def listen(method, params, now):
+        msg_id = None
+        if method == "deleteMessage":
+            msg_id = int(params.get("message_id", 0))
+        elif method == "sendMessage" and str(params.get("text", "")).startswith("Post - "):
+            handle = params["text"].split("X - @", 1)[1].split("\n", 1)[0]
+            msg_id = base + int(handle[1:])
+        entry = pending.get(msg_id)
+        if entry:
+            entry[1] -= 1
+            if not entry[1]:
+                latencies.append(now - api.delivered[entry[0]])
+                del pending[msg_id]
+
+    api.on_call(listen)
+    start = time.perf_counter()
+    for uid in range(2, users + 2):
+        uid_msg = base + uid
+        update_id = api.push(message_update(bot.CHAT_ID, uid, uid_msg, f"https://x.com/u{uid}/status/{uid}", bot.POST_TOPIC_ID))
+        pending[uid_msg] = [update_id, 2]
+    await wait_until(lambda: not pending, timeout)
+    return summarize("burst", limits, latencies, time.perf_counter() - start, users, "posts")
+
+
+async def report(api, bot, limits, members, clicks_per_member, timeout):
+    """/report over a large session, scored against the stand-in clicks API"""
+    bot._clear_session()
+    bot.session_clicks.clear()
+    rnd = random.Random(members)
+    for uid in range(2, members + 2):
+        bot.session_posts.add(uid - 1, uid, bot.parse_link(f"https://x.com/u{uid}/status/{uid}"), f"u{uid}")
+    api.set_clicks(
+        (uid, pn)
+        for uid in range(2, members + 2)
+        for pn in rnd.sample(range(1, members + 1), min(members, clicks_per_member))
+    )
+    done = []
+
+    def listen(method, params, now):
+        if method in ("sendMessage", "sendDocument") and "Engagement Report" in str(params.get("text") or params.get("caption") or ""):
+            done.append(now)
+
+    api.on_call(listen)
+    start = time.perf_counter()
+    update_id = api.push(message_update(bot.CHAT_ID, ADMIN_ID, 900_001, "/report", bot.POST_TOPIC_ID))
+    await wait_until(lambda: done, timeout)
+    return summarize("report", limits, [done[0] - api.delivered[update_id]], time.perf_counter() - start, members, "members")
+
+
+async def clear(api, bot, limits, messages, timeout):
+    """/clear of a topic with many tracked messages; done when every id was deleted"""
+    tid = 777
+    bot.topic_messages[tid] = array("q", range(2_000_000, 2_000_000 + messages))
+    deleted = set()
+    last = []
+
+    def listen(method, params, now):
+        if method == "deleteMessages":
+            deleted.update(params.get("message_ids", ()))
+            last[:] = [now]
+
+    api.on_call(listen)
+    start = time.perf_counter()
+    update_id = api.push(message_update(bot.CHAT_ID, ADMIN_ID, 900_002, "/clear", tid))
+    await wait_until(lambda: len(deleted) >= messages + 1, timeout)
+    return summarize("clear", limits, [last[0] - api.delivered[update_id]], time.perf_counter() - start, messages, "msgs")
+
+
+async def run(args):
+    api = await FakeBotAPI(args.latency, args.rate_429, args.retry_after, admins=[ADMIN_ID]).start()
+    os.environ.update({
+        "TOKEN": TOKEN,
+        "BOT_API_URL": f"{api.url}/bot",
+        "SERVER_URL": api.url,
+        "STATE_DB": "",
+        "NO_PROXY": "127.0.0.1",
+    })
+    bot = importlib.import_module("bot")
+    configs = {
+        "real": (bot.GLOBAL_RATE, bot.GLOBAL_BURST, bot.CHAT_RATE, bot.CHAT_BURST),
+        # Measures the bot itself rather than Telegram's flood limits
+        "unlimited": (UNLIMITED,) * 4,
+    }
+
+    app = bot.app
+    await app.initialize()
+    await app.start()
+    await app.updater.start_polling(poll_interval=0, timeout=1, allowed_updates=bot.Update.ALL_TYPES)
+
+    g, _, c, _ = configs["real"]
+    print(f"latency {args.latency * 1000:.0f}ms, 429 rate {args.rate_429:.1%}, real limits {g:g}/s global, {c:g}/s per chat")
+    results = []
+    try:
+        for limits in args.limits:
+            set_limits(bot, *configs[limits])
+            users = args.real_users if limits == "real" else args.users
+            if "burst" in args.scenarios:
+                results.append(await burst(api, bot, limits, users, args.timeout))
+            if "report" in args.scenarios:
+                results.append(await report(api, bot, limits, args.members, args.clicks, args.timeout))
+            if "clear" in args.scenarios:
+                results.append(await clear(api, bot, limits, args.messages, args.timeout))
+    finally:
+        await app.updater.stop()
+        await app.stop()
+        await app.shutdown()
+        await bot.get_http().close()
+        await api.stop()
+
+    print(f"API calls: {sum(api.calls.values())} ({api.throttled} throttled)")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results, "calls": dict(api.calls)}, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scenarios", nargs="+", default=["burst", "report", "clear"], choices=["burst", "report", "clear"])
+    parser.add_argument("--limits", nargs="+", default=["real", "unlimited"], choices=["real", "unlimited"])
+    parser.add_argument("--users", type=int, default=2000, help="posters in the session-open burst")
+    parser.add_argument("--real-users", type=int, default=60, help="burst size under real limits (~1 post/s per chat)")
+    parser.add_argument("--members", type=int, default=10000, help="session size for /report")
+    parser.add_argument("--clicks", type=int, default=100, help="clicks per member for /report")
+    parser.add_argument("--messages", type=int, default=5000, help="tracked messages for /clear")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every API call")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="fraction of API calls answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after sent with 429s")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--json", help="write results to this file")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,60 @@
+"""
+Post throughput benchmark
+Pushes a session-open burst through handle_message with sequential and concurrent update processing
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+os.environ.setdefault("TOKEN", "123456:BENCH")
+os.environ.setdefault("STATE_DB", "")
+# Measure update processing, not the outbound rate limits
+os.environ.setdefault("GLOBAL_RATE", "100000")
+os.environ.setdefault("GLOBAL_BURST", "100000")
+os.environ.setdefault("CHAT_RATE", "100000")
+os.environ.setdefault("CHAT_BURST", "100000")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot
+from fakes import FakeBot, post_update
+
+
+async def burst(users, concurrency, latency):
+    """Run one post per user through the update processor and return posts/second"""
+    bot._clear_session()
+    bot.session_open = True
+    fake = FakeBot(latency)
+    context = SimpleNamespace(bot=fake)
+    processor = bot.PerUserUpdateProcessor(concurrency)
+
+    updates = [
+        post_update(fake, uid, uid, f"https://x.com/user{uid}/status/{uid}", bot.POST_TOPIC_ID)
+        for uid in range(1, users + 1)
+    ]
+    start = time.perf_counter()
+    await asyncio.gather(*(processor.process_update(u, bot.handle_message(u, context)) for u in updates))
+    elapsed = time.perf_counter() - start
+
+    assert len(bot.session_posts) == users
+    assert sorted(bot.session_posts.by_poster.values()) == list(range(1, users + 1))
+    return users / elapsed
+
+
+async def run(args):
+    print(f"{args.users} posts, {args.latency * 1000:.0f}ms per API call")
+    for concurrency in (1, args.concurrency):
+        rate = await burst(args.users, concurrency, args.latency)
+        label = "sequential" if concurrency == 1 else f"concurrent ({concurrency})"
+        print(f"{label:>16}: {rate:8.1f} posts/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--concurrency", type=int, default=bot.CONCURRENT_UPDATES)
+    asyncio.run(run(parser.parse_args()))
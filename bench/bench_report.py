@@ -0,0 +1,72 @@
+"""
+Report build benchmark
+Times build_report for 100, 1k and 10k session members against a local clicks API
+"""
+
+import asyncio
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("TOKEN", "123456:BENCH")
+# Measure scoring, not the outbound rate limits
+os.environ.setdefault("GLOBAL_RATE", "100000")
+os.environ.setdefault("GLOBAL_BURST", "100000")
+os.environ.setdefault("CHAT_RATE", "100000")
+os.environ.setdefault("CHAT_BURST", "100000")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web
+
+import bot
+from fakes import FakeBot
+
+SIZES = [100, 1000, 10000]
+CLICKS_PER_MEMBER = 100
+
+
+def populate(members):
+    """Fill session state with one post per member and return click records"""
+    bot._clear_session()
+    bot.session_clicks.clear()
+    rnd = random.Random(members)
+    for uid in range(1, members + 1):
+        bot.session_posts.add(uid, uid, bot.parse_link(f"https://x.com/user{uid}/status/{uid}"), f"user{uid}")
+    clicks = []
+    for uid in range(1, members + 1):
+        for pn in rnd.sample(range(1, members + 1), min(members, CLICKS_PER_MEMBER)):
+            clicks.append({"tg_id": uid, "post_num": pn})
+    return clicks
+
+
+async def run():
+    state = {"clicks": []}
+
+    async def api_clicks(request):
+        return web.json_response({"clicks": state["clicks"]})
+
+    app = web.Application()
+    app.router.add_get("/api/clicks/{snum}", api_clicks)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    bot.SERVER_URL = f"http://127.0.0.1:{port}"
+
+    print(f"{'members':>8} {'clicks':>10} {'build (s)':>10} {'messages':>9}")
+    for n in SIZES:
+        state["clicks"] = populate(n)
+        fake = FakeBot()
+        start = time.perf_counter()
+        await bot.build_report(fake, bot.CHAT_ID, bot.POST_TOPIC_ID, 1, do_warn=False)
+        elapsed = time.perf_counter() - start
+        print(f"{n:>8} {len(state['clicks']):>10} {elapsed:>10.3f} {fake.sent:>9}")
+
+    await bot.get_http().close()
+    await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -0,0 +1,173 @@
+"""
+Local stand-in for the Telegram Bot API (and the tracking server's clicks API)
+Serves queued updates to getUpdates, answers the methods the bot calls and records every call
+"""
+
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter
+
+from aiohttp import web
+
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+TRUE_METHODS = {
+    "deleteWebhook", "deleteMessage", "deleteMessages", "restrictChatMember", "banChatMember",
+    "unbanChatMember", "pinChatMessage", "unpinChatMessage", "closeForumTopic", "reopenForumTopic",
+    "answerCallbackQuery", "setMyCommands",
+}
+
+
+def user(uid):
+    return {"id": uid, "is_bot": False, "first_name": f"User {uid}", "username": f"user{uid}"}
+
+
+def message_update(chat_id, uid, message_id, text, thread_id):
+    """Update dict for one topic message; a leading /command gets its entity"""
+    msg = {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "supergroup", "title": "Bench", "is_forum": True},
+        "from": user(uid),
+        "text": text,
+        "message_thread_id": thread_id,
+        "is_topic_message": True,
+    }
+    if text.startswith("/"):
+        msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"message": msg}
+
+
+class FakeBotAPI:
+    """Bot API server with injectable latency and 429s"""
+
+    def __init__(self, latency=0.0, rate_429=0.0, retry_after=1, admins=(), seed=0):
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.admins = list(admins)
+        self.rnd = random.Random(seed)
+        self.pending = []
+        self.next_update = 1
+        self.arrived = asyncio.Event()
+        self.message_ids = itertools.count(10_000_000)
+        self.calls = Counter()
+        self.throttled = 0
+        self.delivered = {}  # update_id -> time handed to the bot
+        self.listener = None
+        self.clicks_body = b'{"clicks": []}'  # served by /api/clicks/{snum}
+        self.runner = None
+        self.url = None
+
+    def push(self, update):
+        """Queue an update for getUpdates; returns its update_id"""
+        update = dict(update, update_id=self.next_update)
+        self.next_update += 1
+        self.pending.append(update)
+        self.arrived.set()
+        return update["update_id"]
+
+    def on_call(self, fn):
+        """Call fn(method, params, now) for every bot request (replaces the previous listener)"""
+        self.listener = fn
+
+    async def start(self, host="127.0.0.1", port=0):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        app.router.add_get("/api/clicks/{snum}", self.handle_clicks)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{self.port}"
+        return self
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+    async def _params(self, request):
+        params = {}
+        if request.content_type == "application/json":
+            params = await request.json()
+        elif request.can_read_body:
+            for key, value in (await request.post()).items():
+                if isinstance(value, str):
+                    try:
+                        value = json.loads(value)
+                    except ValueError:
+                        pass
+                params[key] = value
+        return params
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        params = await self._params(request)
+        self.calls[method] += 1
+        if method == "getUpdates":
+            return self._ok(await self._get_updates(params))
+
+        now = time.perf_counter()
+        if self.listener:
+            self.listener(method, params, now)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.rate_429 and self.rnd.random() < self.rate_429:
+            self.throttled += 1
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }, status=429)
+        return self._ok(self._result(method, params))
+
+    def set_clicks(self, pairs):
+        """Serve (tg_id, post_num) pairs, encoded once so the fixture stays small"""
+        self.clicks_body = ('{"clicks": [' + ",".join(f'{{"tg_id": {u}, "post_num": {p}}}' for u, p in pairs) + "]}").encode()
+
+    async def handle_clicks(self, request):
+        return web.Response(body=self.clicks_body, content_type="application/json")
+
+    def _ok(self, result):
+        return web.json_response({"ok": True, "result": result})
+
+    async def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        self.pending = [u for u in self.pending if u["update_id"] >= offset]
+        if not self.pending:
+            self.arrived.clear()
+            try:
+                await asyncio.wait_for(self.arrived.wait(), float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                return []
+        limit = int(params.get("limit") or 100)
+        batch = self.pending[:limit]
+        now = time.perf_counter()
+        for u in batch:
+            self.delivered.setdefault(u["update_id"], now)
+        return batch
+
+    def _result(self, method, params):
+        if method == "getMe":
+            return BOT_USER
+        if method in TRUE_METHODS:
+            return True
+        if method == "getChatAdministrators":
+            return [{"status": "creator", "user": user(uid), "is_anonymous": False} for uid in self.admins]
+        if method in ("sendMessage", "sendDocument", "editMessageText"):
+            chat_id = int(params.get("chat_id", 0))
+            msg = {
+                "message_id": int(params.get("message_id") or next(self.message_ids)),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "supergroup", "title": "Bench", "is_forum": True},
+                "from": BOT_USER,
+            }
+            if "text" in params:
+                msg["text"] = params["text"]
+            if params.get("message_thread_id"):
+                msg["message_thread_id"] = int(params["message_thread_id"])
+            return msg
+        return True
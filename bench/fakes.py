@@ -0,0 +1,75 @@
+"""
+Stand-ins for the Telegram objects the handlers touch
+"""
+
+import asyncio
+import itertools
+from types import SimpleNamespace
+
+
+class FakeMessage:
+    def __init__(self, message_id):
+        self.message_id = message_id
+
+
+class FakeBot:
+    """Minimal stand-in for telegram.Bot with a fixed per-call latency"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.ids = itertools.count(1_000_000)
+        self.calls = 0
+        self.sent = 0
+
+    async def _call(self):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def send_message(self, **kwargs):
+        await self._call()
+        self.sent += 1
+        return FakeMessage(next(self.ids))
+
+    async def send_document(self, **kwargs):
+        await self._call()
+        self.sent += 1
+        return FakeMessage(next(self.ids))
+
+    async def delete_message(self, *args, **kwargs):
+        await self._call()
+        return True
+
+    async def delete_messages(self, *args, **kwargs):
+        await self._call()
+        return True
+
+    async def get_chat_administrators(self, chat_id):
+        await self._call()
+        return []
+
+    async def restrict_chat_member(self, *args, **kwargs):
+        await self._call()
+        return True
+
+    async def ban_chat_member(self, *args, **kwargs):
+        await self._call()
+        return True
+
+    async def unban_chat_member(self, *args, **kwargs):
+        await self._call()
+        return True
+
+
+def post_update(fake_bot, uid, message_id, text, thread_id):
+    """Build an update carrying one text message from uid"""
+    user = SimpleNamespace(id=uid, username=f"user{uid}", full_name=f"User {uid}")
+    message = SimpleNamespace(
+        message_id=message_id,
+        message_thread_id=thread_id,
+        text=text,
+        from_user=user,
+        reply_to_message=None,
+        delete=fake_bot.delete_message,
+    )
+    return SimpleNamespace(message=message, effective_user=user, effective_chat=SimpleNamespace(id=-100))
@@ -0,0 +1,104 @@
+"""
+Replay a recorded update log (RECORD_FILE) through the real handlers
+The bot talks to the local stand-in Bot API; run with the same CHAT_ID / topic env as production
+"""
+
+import argparse
+import asyncio
+import cProfile
+import gzip
+import importlib
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_api import FakeBotAPI
+
+
+def read_log(path):
+    """[(timestamp, update dict)] from a gzipped JSONL log"""
+    records = []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                rec = json.loads(line)
+                records.append((rec["t"], rec["u"]))
+    return records
+
+
+async def replay(bot, records, speed):
+    """Feed updates into the application; speed 0 means as fast as possible"""
+    app = bot.app
+    t0 = records[0][0]
+    start = time.perf_counter()
+    for t, data in records:
+        if speed:
+            delay = (t - t0) / speed - (time.perf_counter() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await app.update_queue.put(bot.Update.de_json(data, app.bot))
+    while not app.update_queue.empty() or app.update_processor.current_concurrent_updates:
+        await asyncio.sleep(0.01)
+    return time.perf_counter() - start
+
+
+async def run(args):
+    records = read_log(args.log)
+    if not records:
+        print("Empty log")
+        return
+    api = await FakeBotAPI(args.latency, args.rate_429, admins=args.admins).start()
+    os.environ.update({
+        "TOKEN": os.environ.get("TOKEN") or "123456:REPLAY",
+        "BOT_API_URL": f"{api.url}/bot",
+        "SERVER_URL": api.url,
+        "STATE_DB": "",
+        "RECORD_FILE": "",
+        "NO_PROXY": "127.0.0.1",
+    })
+    if not args.real_limits:
+        for key in ("GLOBAL_RATE", "GLOBAL_BURST", "CHAT_RATE", "CHAT_BURST"):
+            os.environ.setdefault(key, "100000")
+    bot = importlib.import_module("bot")
+    bot.session_open = args.open_session
+
+    app = bot.app
+    await app.initialize()
+    await app.start()
+    profiler = cProfile.Profile() if args.profile else None
+    try:
+        if profiler:
+            profiler.enable()
+        elapsed = await replay(bot, records, args.speed)
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        await app.stop()
+        await app.shutdown()
+        await bot.get_http().close()
+        await api.stop()
+
+    span = records[-1][0] - records[0][0]
+    print(f"{len(records)} updates recorded over {span:.1f}s, replayed in {elapsed:.2f}s ({len(records) / elapsed:.1f}/s)")
+    print(f"API calls: {sum(api.calls.values())} ({api.throttled} throttled)")
+    for method, n in api.calls.most_common():
+        print(f"  {method:<24} {n:>7}")
+    if profiler:
+        print(f"Profile written to {args.profile}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("log", help="gzipped JSONL written via RECORD_FILE")
+    parser.add_argument("--speed", type=float, default=0.0, help="1 = recorded pace, 0 = as fast as possible")
+    parser.add_argument("--admins", type=int, nargs="*", default=[], help="user ids the stand-in reports as admins")
+    parser.add_argument("--open-session", action="store_true", help="start with the posting session open")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every API call")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="fraction of API calls answered with 429")
+    parser.add_argument("--real-limits", action="store_true", help="keep the bot's outbound rate limits")
+    parser.add_argument("--profile", help="write cProfile stats for the replay to this file")
+    asyncio.run(run(parser.parse_args()))
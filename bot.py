@@ -3,26 +3,138 @@ Telegram Engagement Bot - PRODUCTION VERSION
 All features properly implemented with proper formatting
 """
 
-from telegram import Update, ChatPermissions, InlineKeyboardMarkup, InlineKeyboardButton
-from telegram.ext import ApplicationBuilder, MessageHandler, CommandHandler, CallbackQueryHandler, ContextTypes, filters
+from telegram import Update, ChatPermissions, InlineKeyboardMarkup, InlineKeyboardButton, LoginUrl
+from telegram.error import RetryAfter, BadRequest
+from telegram.request import HTTPXRequest
+from telegram.ext import ApplicationBuilder, MessageHandler, CommandHandler, CallbackQueryHandler, ChatMemberHandler, ContextTypes, filters, BaseUpdateProcessor
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.events import EVENT_JOB_SUBMITTED, EVENT_JOB_MISSED
 import datetime
 import asyncio
 import os
+import time
+import itertools
+import heapq
+import bisect
+import json
+import re
+from collections import namedtuple, OrderedDict
+import sqlite3
+import hmac
+import hashlib
+import struct
+import zlib
+import gzip
+import cProfile
+import pstats
+import tracemalloc
+import io
+import signal
+import sys
+from array import array
 import aiohttp
-from urllib.parse import quote
+from aiohttp import web
+from urllib.parse import quote, urlsplit
 
 # ═══════════════════════════════════════════════════════════════
 # CONFIGURATION
 # ═══════════════════════════════════════════════════════════════
 TOKEN = os.environ.get("TOKEN", "")
+# Bot API endpoint (a local stand-in for load tests)
+BOT_API_URL = os.environ.get("BOT_API_URL", "https://api.telegram.org/bot")
 CHAT_ID = int(os.environ.get("CHAT_ID", "-1003800205030"))
 POST_TOPIC_ID = int(os.environ.get("POST_TOPIC_ID", "2"))
 WARN_TOPIC_ID = int(os.environ.get("WARN_TOPIC_ID", "902"))
 SERVER_URL = os.environ.get("SERVER_URL", "http://localhost:5000")
+ADMIN_CACHE_TTL = float(os.environ.get("ADMIN_CACHE_TTL", "300"))
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "60000"))
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", str(7 * 86400)))
+
+# Tracking server client
+CLICK_CONNECT_TIMEOUT = float(os.environ.get("CLICK_CONNECT_TIMEOUT", "5"))
+CLICK_READ_TIMEOUT = float(os.environ.get("CLICK_READ_TIMEOUT", "30"))
+CLICK_PAGE_SIZE = int(os.environ.get("CLICK_PAGE_SIZE", "5000"))
+CLICK_FETCH_RETRIES = 3
+CLICK_POLL_INTERVAL = float(os.environ.get("CLICK_POLL_INTERVAL", "60"))
+# Click responses larger than this (chars) are decoded in slices of this size
+CLICK_DECODE_INLINE = 256 * 1024
+
+# Auto-warn enforcement after reports
+ENFORCE_CONCURRENCY = int(os.environ.get("ENFORCE_CONCURRENCY", "8"))
+ENFORCE_DIGEST = os.environ.get("ENFORCE_DIGEST", "") == "1"
+
+# Reports longer than this (chars) go out as a summary plus a .txt attachment
+REPORT_INLINE_LIMIT = min(int(os.environ.get("REPORT_INLINE_LIMIT", "4096")), 4096)
+
+# Built-in click tracker (replaces SERVER_URL when TRACK_PUBLIC_URL is set;
+# the domain must be linked to the bot with BotFather /setdomain for login buttons)
+TRACK_PUBLIC_URL = os.environ.get("TRACK_PUBLIC_URL", "")
+TRACK_LISTEN = os.environ.get("TRACK_LISTEN", "0.0.0.0")
+TRACK_PORT = int(os.environ.get("TRACK_PORT", "8080"))
+TRACK_LOG = os.environ.get("TRACK_LOG", "clicks.log")
+TRACK_AUTH_MAX_AGE = 86400
+TRACK_SECRET = os.environ.get("TRACK_SECRET", "") or hashlib.sha256(b"track:" + TOKEN.encode()).hexdigest()
+TRACK_TOKEN_LIMIT = 50000
+
+# Outbound Bot API limits (Telegram: ~30 req/s overall, ~1 msg/s per chat)
+GLOBAL_RATE = float(os.environ.get("GLOBAL_RATE", "30"))
+GLOBAL_BURST = float(os.environ.get("GLOBAL_BURST", "30"))
+CHAT_RATE = float(os.environ.get("CHAT_RATE", "1"))
+CHAT_BURST = float(os.environ.get("CHAT_BURST", "20"))
+DISPATCH_CONCURRENCY = int(os.environ.get("DISPATCH_CONCURRENCY", "16"))
+DISPATCH_MAX_RETRIES = 3
+
+# Pending auto-deletes survive restarts when a file is set
+DELETE_QUEUE_FILE = os.environ.get("DELETE_QUEUE_FILE", "")
+DELETE_BATCH_WINDOW = 1.0
+DELETE_BATCH_SIZE = 100
+
+# Tracked message ids per topic (oldest dropped past the limit) and resumable /clear
+TOPIC_TRACK_LIMIT = int(os.environ.get("TOPIC_TRACK_LIMIT", "20000"))
+CLEAR_QUEUE_FILE = os.environ.get("CLEAR_QUEUE_FILE", "")
+
+# Durable state (empty disables); writes are batched off the hot path
+STATE_DB = os.environ.get("STATE_DB", "bot_state.db")
+STATE_FLUSH_INTERVAL = 1.0
+# Closed sessions kept for /report N
+ARCHIVE_KEEP = int(os.environ.get("ARCHIVE_KEEP", "28"))
+
+# Update ingestion: "polling" or "webhook"
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")  # required in webhook mode
+UPDATE_QUEUE_SIZE = int(os.environ.get("UPDATE_QUEUE_SIZE", "1000"))
+WEBHOOK_PUT_TIMEOUT = 5.0
+
+# Updates processed at once (updates from one user always run in order)
+CONCURRENT_UPDATES = int(os.environ.get("CONCURRENT_UPDATES", "64"))
+# Updates taken off the queue at once, including ones waiting behind the same user;
+# past this the queue fills up and webhook deliveries get 503
+UPDATE_INFLIGHT = int(os.environ.get("UPDATE_INFLIGHT", "256"))
+# Updates one user may have waiting behind their own (these don't count as in flight); more are dropped
+USER_BACKLOG = int(os.environ.get("USER_BACKLOG", "50"))
+
+# Record every incoming update to this gzipped JSONL file for bench/replay.py (empty disables)
+RECORD_FILE = os.environ.get("RECORD_FILE", "")
+RECORD_FLUSH_INTERVAL = 2.0
+
+# Prometheus-style /metrics endpoint (0 disables; /metrics command works regardless)
+METRICS_LISTEN = os.environ.get("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+
+# On-demand profiling output (/profile, /memsnap, SIGUSR1 / SIGUSR2)
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_TOP = 30
 
 ENGAGE_THRESHOLD = 90
+LEADERBOARD_SIZE = 10
+NAME_REFRESH_INTERVAL = 3600
 MAX_SESSION_NUM = 4
+# Jobs delayed longer than this (seconds) are skipped and counted as missed
+SCHEDULER_GRACE = 300
 
 # IST Session Schedule
 SCHEDULE_IST = [
@@ -39,26 +151,863 @@ def ist_to_utc(h, m):
         t += 1440
     return (t // 60) % 24, t % 60
 
+IST_OFFSET = datetime.timedelta(hours=5, minutes=30)
+
+def last_ist(hm, now=None):
+    """Epoch of the most recent IST h:m at or before now"""
+    ist = datetime.datetime.fromtimestamp(now or time.time(), datetime.timezone.utc) + IST_OFFSET
+    at = ist.replace(hour=hm[0], minute=hm[1], second=0, microsecond=0)
+    if at > ist:
+        at -= datetime.timedelta(days=1)
+    return (at - IST_OFFSET).timestamp()
+
 # ═══════════════════════════════════════════════════════════════
 # STATE VARIABLES
 # ═══════════════════════════════════════════════════════════════
-scheduler = AsyncIOScheduler()
+scheduler = AsyncIOScheduler(job_defaults={"misfire_grace_time": SCHEDULER_GRACE, "coalesce": True})
 bot_instance = None
+http_session = None
 
 session_open = False
 auto_sessions_enabled = True
 session_number = 1
+session_serial = 0
 counter = 1
 
-user_posts = {}
-posted_links = set()
 warnings = {}
-user_cache = {}
 user_streaks = {}
+name_refreshed = {}
 user_last_session = {}
 topic_messages = {}
-session_members = set()
-session_links = {}
+clear_jobs = {}
+clear_tasks = {}
+EMPTY = frozenset()
+session_clicks = {}
+enforcement = {}
+ingest_session = None
+admin_cache = {}
+admin_fetches = {}
+admin_generation = {}
+job_runs = {}  # "open" / "close" / "report" -> when it last ran (epoch)
+
+# ═══════════════════════════════════════════════════════════════
+# METRICS
+# ═══════════════════════════════════════════════════════════════
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Histogram:
+    """Fixed-bucket latency histogram in seconds"""
+    __slots__ = ("counts", "total", "n")
+    
+    def __init__(self):
+        self.counts = array("Q", [0]) * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.n = 0
+    
+    def observe(self, secs):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, secs)] += 1
+        self.total += secs
+        self.n += 1
+    
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile"""
+        rank = q * self.n
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if c and seen >= rank:
+                return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else float("inf")
+        return 0.0
+
+class Metrics:
+    """Latency, errors and in-flight counts per (kind, name): handler, job or api"""
+    
+    def __init__(self):
+        self.latency = {}
+        self.errors = {}
+        self.inflight = {}
+    
+    def start(self, key):
+        self.inflight[key] = self.inflight.get(key, 0) + 1
+        return time.perf_counter()
+    
+    def finish(self, key, started):
+        self.inflight[key] -= 1
+        self.observe(key, time.perf_counter() - started)
+    
+    def observe(self, key, secs):
+        hist = self.latency.get(key)
+        if hist is None:
+            hist = self.latency[key] = Histogram()
+        hist.observe(secs)
+    
+    def error(self, key, exc):
+        self.count(key, type(exc).__name__)
+    
+    def count(self, key, label):
+        ekey = key + (label,)
+        self.errors[ekey] = self.errors.get(ekey, 0) + 1
+    
+    def render(self):
+        """Prometheus text exposition"""
+        out = ["# TYPE bot_latency_seconds histogram"]
+        for (kind, name), h in sorted(self.latency.items()):
+            labels = f'kind="{kind}",name="{name}"'
+            seen = 0
+            for le, c in zip(LATENCY_BUCKETS + ("+Inf",), h.counts):
+                seen += c
+                out.append(f'bot_latency_seconds_bucket{{{labels},le="{le}"}} {seen}')
+            out.append(f"bot_latency_seconds_sum{{{labels}}} {h.total:.6f}")
+            out.append(f"bot_latency_seconds_count{{{labels}}} {h.n}")
+        out.append("# TYPE bot_errors_total counter")
+        for (kind, name, err), n in sorted(self.errors.items()):
+            out.append(f'bot_errors_total{{kind="{kind}",name="{name}",error="{err}"}} {n}')
+        out.append("# TYPE bot_inflight gauge")
+        for (kind, name), n in sorted(self.inflight.items()):
+            out.append(f'bot_inflight{{kind="{kind}",name="{name}"}} {n}')
+        m = dispatcher.metrics()
+        out.append("# TYPE bot_dispatch_queued gauge")
+        for lane in LANE_NAMES.values():
+            out.append(f'bot_dispatch_queued{{lane="{lane}"}} {m[lane]["queued"]}')
+        out.append("# TYPE bot_user_cache_entries gauge")
+        out.append(f"bot_user_cache_entries {len(user_cache)}")
+        return "\n".join(out) + "\n"
+    
+    def summary(self, limit=15):
+        """Busiest handlers/jobs/API calls as short text lines"""
+        errors = {}
+        for (kind, name, _), n in self.errors.items():
+            errors[(kind, name)] = errors.get((kind, name), 0) + n
+        lines = []
+        for key, h in sorted(self.latency.items(), key=lambda i: i[1].total, reverse=True)[:limit]:
+            err = f", {errors[key]} err" if key in errors else ""
+            busy = f", {self.inflight[key]} active" if self.inflight.get(key) else ""
+            lines.append(
+                f"• {key[0]}/{key[1]}: {h.n}× avg {h.total / h.n * 1000:.0f}ms "
+                f"p50≤{h.quantile(0.5) * 1000:.0f}ms p99≤{h.quantile(0.99) * 1000:.0f}ms{err}{busy}"
+            )
+        return lines
+
+metrics = Metrics()
+
+def instrument(kind, fn, name=None):
+    """Wrap an async handler or job so its latency, errors and concurrency are recorded"""
+    key = (kind, name or fn.__name__)
+    
+    async def wrapper(*args, **kwargs):
+        started = metrics.start(key)
+        try:
+            return await fn(*args, **kwargs)
+        except Exception as e:
+            metrics.error(key, e)
+            raise
+        finally:
+            metrics.finish(key, started)
+    wrapper.__name__ = key[1]
+    return wrapper
+
+class InstrumentedRequest(HTTPXRequest):
+    """Bot API transport that records every call per method, dispatched or not"""
+    
+    async def do_request(self, url, method, request_data=None, **timeouts):
+        key = ("api", url.rsplit("/", 1)[-1])
+        started = metrics.start(key)
+        try:
+            code, payload = await super().do_request(url, method, request_data, **timeouts)
+        except Exception as e:
+            metrics.error(key, e)
+            raise
+        finally:
+            metrics.finish(key, started)
+        if code >= 400:
+            metrics.count(key, str(code))
+        return code, payload
+
+metrics_runner = None
+
+async def metrics_handler(request):
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+async def start_metrics_server():
+    """Serve Prometheus-style /metrics locally"""
+    global metrics_runner
+    web_app = web.Application()
+    web_app.router.add_get("/metrics", metrics_handler)
+    metrics_runner = web.AppRunner(web_app, access_log=None)
+    await metrics_runner.setup()
+    await web.TCPSite(metrics_runner, METRICS_LISTEN, METRICS_PORT).start()
+    print(f"✅ Metrics on http://{METRICS_LISTEN}:{METRICS_PORT}/metrics")
+
+# ═══════════════════════════════════════════════════════════════
+# OUTBOUND DISPATCHER
+# ═══════════════════════════════════════════════════════════════
+# Priority lanes - lower runs first
+LANE_MODERATION = 0
+LANE_POST = 1
+LANE_NOTICE = 2
+LANE_NAMES = {LANE_MODERATION: "moderation", LANE_POST: "post", LANE_NOTICE: "notice"}
+# Telegram's per-chat limit only counts messages the bot posts; everything else is global-only
+CHAT_LIMITED_CALLS = frozenset({"send_message", "send_document", "reply_text"})
+
+class TokenBucket:
+    """Token bucket with an optional RetryAfter pause"""
+    
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+    
+    def delay(self):
+        """Seconds until a token is available"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+    
+    def take(self):
+        self.tokens -= 1
+    
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+class _Job:
+    __slots__ = ("lane", "seq", "chat_id", "call", "args", "kwargs", "future", "queued_at", "attempts")
+    
+    def __lt__(self, other):
+        return (self.lane, self.seq) < (other.lane, other.seq)
+
+class Dispatcher:
+    """Single path for outbound Bot API calls with rate limiting and priority lanes"""
+    
+    def __init__(self):
+        self.global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_BURST)
+        self.chat_buckets = {}
+        self.seq = itertools.count()
+        self.pending = {}  # chat id (None = global bucket only) -> heap of jobs
+        self.wake = None
+        self.worker = None
+        self.slots = None
+        self.inflight = 0
+        self.stats = {lane: {"sent": 0, "failed": 0, "retried": 0, "wait_total": 0.0, "wait_max": 0.0} for lane in LANE_NAMES}
+    
+    def _start(self):
+        if self.worker is None or self.worker.done():
+            self.wake = asyncio.Event()
+            self.slots = asyncio.Semaphore(DISPATCH_CONCURRENCY)
+            self.worker = asyncio.ensure_future(self._run())
+    
+    def _bucket(self, chat_id):
+        if chat_id is None:
+            return None
+        b = self.chat_buckets.get(chat_id)
+        if b is None:
+            b = self.chat_buckets[chat_id] = TokenBucket(CHAT_RATE, CHAT_BURST)
+        return b
+    
+    async def submit(self, lane, chat_id, call, args=(), kwargs=None):
+        """Queue a call and wait for its result"""
+        self._start()
+        job = _Job()
+        job.lane = lane
+        job.seq = next(self.seq)
+        job.chat_id = chat_id if getattr(call, "__name__", "") in CHAT_LIMITED_CALLS else None
+        job.call = call
+        job.args = args
+        job.kwargs = kwargs or {}
+        job.future = asyncio.get_running_loop().create_future()
+        job.queued_at = time.monotonic()
+        job.attempts = 0
+        self._push(job)
+        return await job.future
+    
+    def _push(self, job):
+        heapq.heappush(self.pending.setdefault(job.chat_id, []), job)
+        self.wake.set()
+    
+    def _next(self):
+        """Highest-priority job whose buckets have a token, else (None, seconds until one might)"""
+        best = None
+        wait = None
+        ready = self.global_bucket.delay()
+        for chat_id, heap in list(self.pending.items()):
+            while heap and heap[0].future.done():
+                heapq.heappop(heap)
+            if not heap:
+                del self.pending[chat_id]
+                continue
+            chat = self._bucket(chat_id)
+            delay = max(ready, chat.delay() if chat else 0.0)
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+            elif best is None or heap[0] < best[0]:
+                best = heap
+        if best is None:
+            return None, wait
+        job = heapq.heappop(best)
+        if not best:
+            del self.pending[job.chat_id]
+        return job, 0.0
+    
+    async def _run(self):
+        while True:
+            job, wait = self._next()
+            if job is None:
+                # A blocked chat only holds back its own jobs; new submissions wake us early
+                self.wake.clear()
+                try:
+                    await asyncio.wait_for(self.wake.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self.global_bucket.take()
+            chat = self._bucket(job.chat_id)
+            if chat:
+                chat.take()
+            
+            st = self.stats[job.lane]
+            waited = time.monotonic() - job.queued_at
+            st["wait_total"] += waited
+            st["wait_max"] = max(st["wait_max"], waited)
+            
+            await self.slots.acquire()
+            asyncio.ensure_future(self._execute(job))
+    
+    async def _execute(self, job):
+        self.inflight += 1
+        st = self.stats[job.lane]
+        try:
+            result = await job.call(*job.args, **job.kwargs)
+        except RetryAfter as e:
+            secs = e.retry_after
+            if isinstance(secs, datetime.timedelta):
+                secs = secs.total_seconds()
+            (self._bucket(job.chat_id) or self.global_bucket).pause(secs)
+            if job.attempts < DISPATCH_MAX_RETRIES:
+                job.attempts += 1
+                st["retried"] += 1
+                self._push(job)
+            else:
+                st["failed"] += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+        except Exception as e:
+            st["failed"] += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            st["sent"] += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self.inflight -= 1
+            self.slots.release()
+    
+    def metrics(self):
+        """Queue depth and wait-time summary per lane"""
+        depth = {lane: 0 for lane in LANE_NAMES}
+        for heap in self.pending.values():
+            for job in heap:
+                depth[job.lane] += 1
+        out = {"inflight": self.inflight}
+        for lane, name in LANE_NAMES.items():
+            st = self.stats[lane]
+            done = st["sent"] + st["failed"]
+            out[name] = {
+                "queued": depth[lane],
+                "sent": st["sent"],
+                "failed": st["failed"],
+                "retried": st["retried"],
+                "wait_avg": st["wait_total"] / done if done else 0.0,
+                "wait_max": st["wait_max"],
+            }
+        return out
+
+dispatcher = Dispatcher()
+
+async def dispatch(lane, chat_id, call, /, *args, **kwargs):
+    """Send an outbound Bot API call through the dispatcher"""
+    return await dispatcher.submit(lane, chat_id, call, args, kwargs)
+
+# ═══════════════════════════════════════════════════════════════
+# DELETION SCHEDULER
+# ═══════════════════════════════════════════════════════════════
+class DeleteScheduler:
+    """One deadline heap for every pending auto-delete, flushed in bulk"""
+    
+    def __init__(self, path=""):
+        self.path = path
+        self.heap = []
+        self.bot = None
+        self.wake = None
+        self.task = None
+        self.dirty = False
+    
+    def schedule(self, bot, chat_id, msg_id, delay):
+        """Queue a message for deletion after delay seconds"""
+        self.bot = bot
+        due = time.time() + delay
+        head = self.heap[0][0] if self.heap else None
+        heapq.heappush(self.heap, (due, chat_id, msg_id))
+        self.dirty = True
+        self._start()
+        if head is None or due < head:
+            self.wake.set()
+    
+    def _start(self):
+        if self.task is None or self.task.done():
+            self.wake = asyncio.Event()
+            self.task = asyncio.ensure_future(self._run())
+    
+    async def _run(self):
+        while True:
+            self._save()
+            if not self.heap:
+                self.wake.clear()
+                await self.wake.wait()
+                continue
+            delay = self.heap[0][0] - time.time()
+            if delay > 0:
+                self.wake.clear()
+                try:
+                    await asyncio.wait_for(self.wake.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            # Everything due within the batch window goes out together
+            cutoff = time.time() + DELETE_BATCH_WINDOW
+            due = {}
+            while self.heap and self.heap[0][0] <= cutoff:
+                _, chat_id, msg_id = heapq.heappop(self.heap)
+                due.setdefault(chat_id, []).append(msg_id)
+            self.dirty = True
+            for chat_id, ids in due.items():
+                for i in range(0, len(ids), DELETE_BATCH_SIZE):
+                    asyncio.ensure_future(self._delete(chat_id, ids[i:i + DELETE_BATCH_SIZE]))
+    
+    async def _delete(self, chat_id, ids):
+        try:
+            await dispatch(LANE_NOTICE, chat_id, self.bot.delete_messages, chat_id, ids)
+        except:
+            pass
+    
+    def _save(self):
+        if not (self.path and self.dirty):
+            return
+        self.dirty = False
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(self.heap, f)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+    
+    def restore(self, bot):
+        """Reload pending deletes saved before a restart"""
+        self.bot = bot
+        if not (self.path and os.path.exists(self.path)):
+            return
+        try:
+            with open(self.path) as f:
+                pending = json.load(f)
+        except (OSError, ValueError):
+            return
+        for due, chat_id, msg_id in pending:
+            heapq.heappush(self.heap, (due, chat_id, msg_id))
+        if self.heap:
+            self._start()
+            self.wake.set()
+
+delete_scheduler = DeleteScheduler(DELETE_QUEUE_FILE)
+
+# ═══════════════════════════════════════════════════════════════
+# STATE STORE
+# ═══════════════════════════════════════════════════════════════
+# table -> (key column, value columns)
+STATE_TABLES = {
+    "kv": ("key TEXT", ["value"]),
+    "warnings": ("uid INTEGER", ["count INTEGER"]),
+    "streaks": ("uid INTEGER", ["streak INTEGER", "last_session INTEGER"]),
+    "posts": ("post_num INTEGER", ["link", "url TEXT", "poster_id INTEGER", "x_username TEXT", "msg_id INTEGER"]),
+    "tokens": ("id INTEGER", ["serial INTEGER", "post INTEGER", "url TEXT"]),
+    "enforcement": ("key TEXT", ["warn_count INTEGER", "status TEXT"]),
+    "archive": ("serial INTEGER", ["snum INTEGER", "closed REAL", "data BLOB"]),
+}
+
+class StateStore:
+    """SQLite (WAL) write-behind store - handlers only append to an in-memory op list"""
+    
+    def __init__(self, path):
+        self.path = path
+        self.db = None
+        self.ops = []
+        self.task = None
+        self.sql = {}
+        # Every write and read after startup goes through this, so batches land in order
+        self.lock = asyncio.Lock()
+    
+    def open(self):
+        if not self.path:
+            return False
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        for table, (key, cols) in STATE_TABLES.items():
+            self.db.execute(f"CREATE TABLE IF NOT EXISTS {table} ({', '.join([key + ' PRIMARY KEY'] + cols)})")
+            keycol = key.split()[0]
+            marks = ", ".join("?" * (len(cols) + 1))
+            self.sql[table] = (
+                f"INSERT OR REPLACE INTO {table} VALUES ({marks})",
+                f"DELETE FROM {table} WHERE {keycol} = ?",
+                f"DELETE FROM {table}",
+                f"DELETE FROM {table} WHERE {keycol} < ?",
+            )
+        self.db.commit()
+        return True
+    
+    def put(self, table, key, *values):
+        if self.db:
+            self.ops.append((0, table, (key,) + values))
+    
+    def delete(self, table, key):
+        if self.db:
+            self.ops.append((1, table, (key,)))
+    
+    def clear(self, table):
+        if self.db:
+            self.ops.append((2, table, ()))
+    
+    def prune(self, table, below):
+        if self.db:
+            self.ops.append((3, table, (below,)))
+    
+    def rows(self, table):
+        return self.db.execute(f"SELECT * FROM {table}").fetchall()
+    
+    def _write(self, ops):
+        with self.db:
+            for kind, table, params in ops:
+                self.db.execute(self.sql[table][kind], params)
+    
+    async def flush(self):
+        """Write pending ops in a worker thread, one batch at a time"""
+        if not self.db:
+            return
+        async with self.lock:
+            await self._flush()
+    
+    async def _flush(self):
+        if not self.ops:
+            return
+        ops, self.ops = self.ops, []
+        try:
+            await asyncio.to_thread(self._write, ops)
+        except sqlite3.Error as e:
+            print(f"⚠️ State flush failed: {e}")
+            self.ops[:0] = ops
+    
+    async def fetchone(self, sql, params=()):
+        """Read after writing pending ops, off the event loop"""
+        async with self.lock:
+            await self._flush()
+            return await asyncio.to_thread(lambda: self.db.execute(sql, params).fetchone())
+    
+    def start(self):
+        if self.db and (self.task is None or self.task.done()):
+            self.task = asyncio.ensure_future(self._run())
+    
+    async def stop(self):
+        """Stop the background writer, then write what is left"""
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.flush()
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(STATE_FLUSH_INTERVAL)
+            # Shielded so a cancel at shutdown never abandons a batch mid-write
+            await asyncio.shield(self.flush())
+
+store = StateStore(STATE_DB)
+
+def save_kv():
+    """Persist scalar session state"""
+    store.put("kv", "counter", counter)
+    store.put("kv", "session_number", session_number)
+    store.put("kv", "session_serial", session_serial)
+    store.put("kv", "session_open", int(session_open))
+    store.put("kv", "auto_sessions_enabled", int(auto_sessions_enabled))
+
+def load_state():
+    """Restore all persisted state into the module globals"""
+    global counter, session_number, session_serial, session_open, auto_sessions_enabled
+    if not store.open():
+        return
+    kv = dict(store.rows("kv"))
+    counter = kv.get("counter", counter)
+    session_number = kv.get("session_number", session_number)
+    session_serial = kv.get("session_serial", session_serial)
+    session_open = bool(kv.get("session_open", session_open))
+    auto_sessions_enabled = bool(kv.get("auto_sessions_enabled", auto_sessions_enabled))
+    warnings.update(store.rows("warnings"))
+    for uid, streak, last in store.rows("streaks"):
+        set_streak(uid, streak)
+        user_last_session[uid] = last
+    session_posts.load(store.rows("posts"))
+    tokens.load(sorted(store.rows("tokens")))
+    for key, wc, status in store.rows("enforcement"):
+        enforcement[key] = [wc, status]
+    for stage in ("open", "close", "report"):
+        if f"ran_{stage}" in kv:
+            job_runs[stage] = kv[f"ran_{stage}"]
+    archive.load(store.db.execute("SELECT serial, snum FROM archive ORDER BY serial").fetchall())
+
+# ═══════════════════════════════════════════════════════════════
+# LINK PARSING
+# ═══════════════════════════════════════════════════════════════
+URL_RE = re.compile(r"https?://[^\s<>]+", re.I)
+X_STATUS_RE = re.compile(
+    r"https?://((?:(?:www|mobile|m)\.)?(?:x|twitter)\.com)/(?:i/web|([A-Za-z0-9_]{1,15}))/status(?:es)?/(\d+)",
+    re.I
+)
+X_HOST_RE = re.compile(r"(?:(?:www|mobile|m)\.)?(?:x|twitter)\.com$", re.I)
+X_PROFILE_RE = re.compile(r"https?://(?:(?:www|mobile|m)\.)?(?:x|twitter)\.com/([A-Za-z0-9_]{1,15})(?:[/?#]|$)", re.I)
+
+# key: status id for X posts (dedupe), else the URL itself
+ParsedLink = namedtuple("ParsedLink", "url host handle status_id key")
+
+def parse_link(text):
+    """Extract the first link in a message, canonicalizing X status links"""
+    m = URL_RE.search(text)
+    if not m:
+        return None
+    raw = m.group(0)
+    x = X_STATUS_RE.match(raw)
+    if not x:
+        # Other X pages (profiles, /i/spaces/...) still name their account by the first path segment
+        p = X_PROFILE_RE.match(raw)
+        return ParsedLink(raw, (urlsplit(raw).hostname or "").lower(), p.group(1) if p else None, None, raw)
+    handle = x.group(2) or "i"
+    status_id = int(x.group(3))
+    return ParsedLink(f"https://x.com/{handle}/status/{status_id}", x.group(1).lower(), handle, status_id, status_id)
+
+# ═══════════════════════════════════════════════════════════════
+# SESSION POSTS
+# ═══════════════════════════════════════════════════════════════
+class SessionTable:
+    """Session posts as parallel columns indexed by post number, with poster and link indexes"""
+    
+    def __init__(self):
+        self.posters = array("q")  # 0 = free slot
+        self.msgs = array("q")  # repost message id, 0 until sent, -1 once its poster deleted it
+        self.keys = []
+        self.urls = []
+        self.handles = []
+        self.by_poster = {}  # uid -> post number
+        self.removed = {}  # uid -> deleted post number (the member is still scored)
+        self.by_key = {}  # link key -> post number (deleted posts keep their link)
+        self.sent = 0
+    
+    def clear(self):
+        del self.posters[:]
+        del self.msgs[:]
+        self.keys.clear()
+        self.urls.clear()
+        self.handles.clear()
+        self.by_poster.clear()
+        self.removed.clear()
+        self.by_key.clear()
+        self.sent = 0
+        store.clear("posts")
+    
+    def __len__(self):
+        return len(self.by_poster)
+    
+    def _save(self, post_num):
+        i = post_num - 1
+        store.put("posts", post_num, self.keys[i], self.urls[i], self.posters[i], self.handles[i], self.msgs[i])
+    
+    def _set(self, post_num, key, url, uid, handle, msg_id):
+        i = post_num - 1
+        if i >= len(self.posters):
+            grow = i + 1 - len(self.posters)
+            self.posters.extend(array("q", [0]) * grow)
+            self.msgs.extend(array("q", [0]) * grow)
+            self.keys.extend([None] * grow)
+            self.urls.extend([None] * grow)
+            self.handles.extend([None] * grow)
+        self.posters[i] = uid
+        self.msgs[i] = msg_id
+        self.keys[i] = key
+        self.urls[i] = url
+        self.handles[i] = sys.intern(handle) if handle else handle
+        self.by_key[key] = post_num
+        if uid and msg_id < 0:
+            self.removed[uid] = post_num
+        elif uid:
+            self.by_poster[uid] = post_num
+        if msg_id > 0:
+            self.sent += 1
+    
+    def add(self, post_num, uid, link, handle):
+        """Reserve a post before it is sent; returns the reservation for sent_as and rollback"""
+        self._set(post_num, link.key, link.url, uid, handle, 0)
+        self._save(post_num)
+        return (session_serial, post_num, uid)
+    
+    def holds(self, reservation):
+        """Whether a reservation still owns its slot (no session clear or delete since)"""
+        serial, post_num, uid = reservation
+        return serial == session_serial and self.poster(post_num) == uid
+    
+    def sent_as(self, reservation, msg_id):
+        """Record the repost's message id; False if the reservation is gone"""
+        if not self.holds(reservation):
+            return False
+        post_num = reservation[1]
+        self.msgs[post_num - 1] = msg_id
+        self.sent += 1
+        self._save(post_num)
+        return True
+    
+    def msg_id(self, uid):
+        """Repost message id of a member's post, 0 if none"""
+        post_num = self.by_poster.get(uid)
+        return self.msgs[post_num - 1] if post_num else 0
+    
+    def poster(self, post_num):
+        """Poster of a live post, 0 if free or deleted"""
+        i = post_num - 1
+        return self.posters[i] if 0 <= i < len(self.posters) and self.msgs[i] >= 0 else 0
+    
+    def remove(self, uid):
+        """Delete a member's post; its link stays used and the member is still scored"""
+        post_num = self.by_poster.pop(uid, None)
+        if post_num is None:
+            return
+        i = post_num - 1
+        if self.msgs[i] > 0:
+            self.sent -= 1
+        self.msgs[i] = -1
+        self.removed[uid] = post_num
+        self._save(post_num)
+    
+    def drop(self, uid):
+        """Undo a reservation entirely so the member and link can post again"""
+        post_num = self.by_poster.pop(uid, None)
+        if post_num is None:
+            return
+        i = post_num - 1
+        if self.msgs[i] > 0:
+            self.sent -= 1
+        self.by_key.pop(self.keys[i], None)
+        self.posters[i] = 0
+        self.msgs[i] = 0
+        self.keys[i] = self.urls[i] = self.handles[i] = None
+        store.delete("posts", post_num)
+    
+    def members(self):
+        """uid -> scored post number: the live post, else the one the member deleted"""
+        if not self.removed:
+            return self.by_poster
+        members = dict(self.removed)
+        members.update(self.by_poster)
+        return members
+    
+    def rows(self):
+        """(uid, post number, X handle) per member"""
+        return [(uid, pn, self.handles[pn - 1]) for uid, pn in self.members().items()]
+    
+    def load(self, rows):
+        for post_num, key, url, uid, handle, msg_id in rows:
+            self._set(post_num, key, url, uid, handle, msg_id)
+
+session_posts = SessionTable()
+
+# ═══════════════════════════════════════════════════════════════
+# USER CACHE
+# ═══════════════════════════════════════════════════════════════
+class CachedUser:
+    """Compact user record - just what names and lookups need"""
+    __slots__ = ("id", "username", "full_name", "seen")
+    
+    def __init__(self, uid, username, full_name):
+        self.id = uid
+        self.username = username
+        self.full_name = full_name
+        self.seen = time.monotonic()
+
+class UserCache:
+    """Bounded LRU of CachedUser by id with a username -> id index"""
+    
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.users = OrderedDict()
+        self.usernames = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def __len__(self):
+        return len(self.users)
+    
+    def put(self, user):
+        old = self.users.get(user.id)
+        if old is not None:
+            if old.username and old.username.lower() != (user.username or "").lower():
+                self.usernames.pop(old.username.lower(), None)
+            self.users.move_to_end(user.id)
+        rec = self.users[user.id] = CachedUser(user.id, user.username, user.full_name)
+        if rec.username:
+            self.usernames[rec.username.lower()] = rec.id
+        while len(self.users) > self.size:
+            _, evicted = self.users.popitem(last=False)
+            self._drop_username(evicted)
+            self.evictions += 1
+    
+    def _drop_username(self, rec):
+        if rec.username and self.usernames.get(rec.username.lower()) == rec.id:
+            del self.usernames[rec.username.lower()]
+    
+    def get(self, uid):
+        rec = self.users.get(uid)
+        if rec is not None and time.monotonic() - rec.seen > self.ttl:
+            del self.users[uid]
+            self._drop_username(rec)
+            self.evictions += 1
+            rec = None
+        if rec is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.users.move_to_end(uid)
+        return rec
+    
+    def find(self, username):
+        """Look up by lowercase username"""
+        uid = self.usernames.get(username)
+        if uid is None:
+            self.misses += 1
+            return None
+        return self.get(uid)
+    
+    def stats(self):
+        return {"size": len(self.users), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+user_cache = UserCache(USER_CACHE_SIZE, USER_CACHE_TTL)
 
 # ═══════════════════════════════════════════════════════════════
 # HELPER FUNCTIONS
@@ -74,42 +1023,55 @@ def timing_text_ist():
         times.append(f"{h12}:{str(m).zfill(2)} {period} IST")
     return "\n• ".join(times)
 
-async def auto_delete_after(context, chat_id, msg_id, delay=10):
+def auto_delete_after(context, chat_id, msg_id, delay=10):
     """Auto-delete message after delay"""
-    await asyncio.sleep(delay)
-    try:
-        await context.bot.delete_message(chat_id=chat_id, message_id=msg_id)
-    except:
-        pass
+    delete_scheduler.schedule(context.bot, chat_id, msg_id, delay)
 
 def _cache_user(user):
     """Cache user for quick lookup"""
     if not user:
         return
-    user_cache[user.id] = user
-    if user.username:
-        user_cache[user.username.lower()] = user
+    user_cache.put(user)
+
+def rollback_post(reservation, prev_streak):
+    """Undo a reserved post whose repost failed so the user can post again"""
+    if not session_posts.holds(reservation):
+        # The session was cleared meanwhile; the streak now belongs to the new one
+        return
+    uid = reservation[2]
+    session_posts.drop(uid)
+    streak, last = prev_streak
+    if last is None:
+        set_streak(uid, None)
+        user_last_session.pop(uid, None)
+        store.delete("streaks", uid)
+    else:
+        set_streak(uid, streak)
+        user_last_session[uid] = last
+        store.put("streaks", uid, streak, last)
 
 def track_msg(thread_id, msg_id):
     """Track message for later cleanup"""
-    topic_messages.setdefault(thread_id, []).append(msg_id)
+    ids = topic_messages.get(thread_id)
+    if ids is None:
+        ids = topic_messages[thread_id] = array("q")
+    ids.append(msg_id)
+    # Trim in chunks so the cap costs one shift per 1024 appends
+    if len(ids) > TOPIC_TRACK_LIMIT + 1024:
+        del ids[:len(ids) - TOPIC_TRACK_LIMIT]
 
 async def send_warn_msg(bot, text):
     """Send notification to warn topic"""
     kwargs = {"chat_id": CHAT_ID, "text": text}
     if WARN_TOPIC_ID:
         kwargs["message_thread_id"] = WARN_TOPIC_ID
-    msg = await bot.send_message(**kwargs)
+    msg = await dispatch(LANE_NOTICE, CHAT_ID, bot.send_message, **kwargs)
     # Warn messages stay visible - no auto-delete
     return msg
 
-async def auto_delete_message(bot, chat_id, msg_id, delay=10):
+def auto_delete_message(bot, chat_id, msg_id, delay=10):
     """Helper to auto-delete any message"""
-    await asyncio.sleep(delay)
-    try:
-        await bot.delete_message(chat_id=chat_id, message_id=msg_id)
-    except:
-        pass
+    delete_scheduler.schedule(bot, chat_id, msg_id, delay)
 
 def next_session_num(n):
     """Calculate next session number"""
@@ -118,18 +1080,51 @@ def next_session_num(n):
 # ═══════════════════════════════════════════════════════════════
 # ADMIN & USER FUNCTIONS
 # ═══════════════════════════════════════════════════════════════
-async def is_admin(update, context):
-    """Check if user is admin"""
-    admins = await context.bot.get_chat_administrators(update.effective_chat.id)
+async def _fetch_admins(bot, chat_id):
+    """Fetch admins from Telegram and store them in the cache"""
+    gen = admin_generation.get(chat_id, 0)
+    admins = await bot.get_chat_administrators(chat_id)
+    users = {}
     for a in admins:
         _cache_user(a.user)
-    return update.effective_user.id in {a.user.id for a in admins}
+        users[a.user.id] = a.user
+    # Skip the store if a promotion/demotion invalidated the cache mid-fetch
+    if admin_generation.get(chat_id, 0) == gen:
+        admin_cache[chat_id] = (time.monotonic() + ADMIN_CACHE_TTL, users)
+    return users
+
+async def get_admins(bot, chat_id):
+    """Get admins as {user_id: User}, cached per chat with single-flight refresh"""
+    entry = admin_cache.get(chat_id)
+    if entry and entry[0] > time.monotonic():
+        return entry[1]
+    
+    task = admin_fetches.get(chat_id)
+    if task is None:
+        task = asyncio.ensure_future(_fetch_admins(bot, chat_id))
+        admin_fetches[chat_id] = task
+        
+        def done(t, chat_id=chat_id):
+            if admin_fetches.get(chat_id) is t:
+                del admin_fetches[chat_id]
+        task.add_done_callback(done)
+    return await asyncio.shield(task)
+
+def invalidate_admins(chat_id):
+    """Drop cached admins for a chat"""
+    admin_generation[chat_id] = admin_generation.get(chat_id, 0) + 1
+    admin_cache.pop(chat_id, None)
+    admin_fetches.pop(chat_id, None)
+
+async def is_admin(update, context):
+    """Check if user is admin"""
+    admins = await get_admins(context.bot, update.effective_chat.id)
+    return update.effective_user.id in admins
 
 async def get_admin_ids(bot):
     """Get list of admin IDs"""
     try:
-        admins = await bot.get_chat_administrators(CHAT_ID)
-        return {a.user.id for a in admins}
+        return set(await get_admins(bot, CHAT_ID))
     except:
         return set()
 
@@ -150,8 +1145,9 @@ async def get_target_user(update, context):
     # Try as user ID
     if target.isdigit():
         uid = int(target)
-        if uid in user_cache:
-            return user_cache[uid]
+        cached = user_cache.get(uid)
+        if cached:
+            return cached
         try:
             m = await context.bot.get_chat_member(CHAT_ID, uid)
             _cache_user(m.user)
@@ -160,16 +1156,16 @@ async def get_target_user(update, context):
             pass
     
     # Try as username
-    if target in user_cache:
-        return user_cache[target]
+    cached = user_cache.find(target)
+    if cached:
+        return cached
     
     # Search in admins
     try:
-        admins = await context.bot.get_chat_administrators(update.effective_chat.id)
-        for a in admins:
-            if a.user.username and a.user.username.lower() == target:
-                _cache_user(a.user)
-                return a.user
+        admins = await get_admins(context.bot, update.effective_chat.id)
+        for u in admins.values():
+            if u.username and u.username.lower() == target:
+                return u
     except:
         pass
     
@@ -178,14 +1174,59 @@ async def get_target_user(update, context):
 # ═══════════════════════════════════════════════════════════════
 # STREAK FUNCTIONS
 # ═══════════════════════════════════════════════════════════════
+class StreakIndex:
+    """Members bucketed by streak with the distinct streak values kept sorted"""
+    
+    def __init__(self):
+        self.buckets = {}
+        self.values = []
+    
+    def move(self, uid, old, new):
+        if old is not None:
+            bucket = self.buckets[old]
+            del bucket[uid]
+            if not bucket:
+                del self.buckets[old]
+                del self.values[bisect.bisect_left(self.values, old)]
+        if new is not None:
+            bucket = self.buckets.get(new)
+            if bucket is None:
+                bucket = self.buckets[new] = {}
+                bisect.insort(self.values, new)
+            bucket[uid] = None
+    
+    def top(self, k):
+        """[(uid, streak)] for the k longest streaks"""
+        out = []
+        for streak in reversed(self.values):
+            for uid in self.buckets[streak]:
+                out.append((uid, streak))
+                if len(out) == k:
+                    return out
+        return out
+
+streak_index = StreakIndex()
+
+def set_streak(uid, streak):
+    """Set (or with None, drop) a streak and keep the index in step"""
+    old = user_streaks.get(uid)
+    if old == streak:
+        return
+    if streak is None:
+        del user_streaks[uid]
+    else:
+        user_streaks[uid] = streak
+    streak_index.move(uid, old, streak)
+
 def update_streak(uid):
     """Update user streak"""
     last = user_last_session.get(uid)
     if last is not None and last == session_number - 1:
-        user_streaks[uid] = user_streaks.get(uid, 0) + 1
+        set_streak(uid, user_streaks.get(uid, 0) + 1)
     elif last != session_number:
-        user_streaks[uid] = 1
+        set_streak(uid, 1)
     user_last_session[uid] = session_number
+    store.put("streaks", uid, user_streaks.get(uid, 0), session_number)
 
 def streak_emoji(n):
     """Get streak emoji"""
@@ -199,175 +1240,757 @@ def streak_emoji(n):
         return "⚡"
     return ""
 
+def display_name(user):
+    """@username, else full name"""
+    return f"@{user.username}" if user.username else user.full_name
+
+async def _lookup_member(bot, uid):
+    try:
+        m = await bot.get_chat_member(CHAT_ID, uid)
+    except:
+        return None
+    _cache_user(m.user)
+    name_refreshed[uid] = time.monotonic()
+    return m.user
+
+async def _refresh_names(bot, uids):
+    await asyncio.gather(*(_lookup_member(bot, uid) for uid in uids))
+
+async def resolve_names(bot, uids):
+    """{uid: name} from user_cache, looking up misses concurrently and refreshing stale names in the background"""
+    names, missing, stale = {}, [], []
+    now = time.monotonic()
+    for uid in uids:
+        u = user_cache.get(uid)
+        if u is None:
+            missing.append(uid)
+            continue
+        names[uid] = display_name(u)
+        if now - name_refreshed.get(uid, 0) > NAME_REFRESH_INTERVAL:
+            name_refreshed[uid] = now
+            stale.append(uid)
+    
+    if missing:
+        found = await asyncio.gather(*(_lookup_member(bot, uid) for uid in missing))
+        for uid, u in zip(missing, found):
+            names[uid] = display_name(u) if u else f"User{uid}"
+    if stale:
+        asyncio.ensure_future(_refresh_names(bot, stale))
+    return names
+
 async def send_leaderboard(bot, cid, tid, snum):
     """Send streak leaderboard"""
     if not user_streaks:
         return
     
-    top = sorted(user_streaks.items(), key=lambda x: x[1], reverse=True)[:10]
+    top = streak_index.top(LEADERBOARD_SIZE)
+    names = await resolve_names(bot, [uid for uid, _ in top])
     lines = [f"🏆 Streak Leaderboard — Session {snum}\n"]
     
     for rank, (uid, s) in enumerate(top, 1):
         e = streak_emoji(s)
-        try:
-            m = await bot.get_chat_member(cid, uid)
-            name = f"@{m.user.username}" if m.user.username else m.user.full_name
-        except:
-            name = f"User{uid}"
-        lines.append(f"{rank}. {name} — {s} sessions {e}")
+        lines.append(f"{rank}. {names[uid]} — {s} sessions {e}")
     
     lines.append("\n🔥 Keep posting every session!")
-    lb = await bot.send_message(chat_id=cid, message_thread_id=tid, text="\n".join(lines))
+    lb = await dispatch(LANE_NOTICE, cid, bot.send_message, chat_id=cid, message_thread_id=tid, text="\n".join(lines))
     track_msg(tid, lb.message_id)
 
 # ═══════════════════════════════════════════════════════════════
-# REPORT GENERATION
+# CLICK FETCHING
 # ═══════════════════════════════════════════════════════════════
-async def build_report(bot, cid, tid, snum, do_warn=True):
-    """Generate engagement report"""
-    if not session_members:
-        await bot.send_message(chat_id=cid, message_thread_id=tid, text=f"📊 Session {snum} — No posts")
+def get_http():
+    """Shared pooled HTTP client for the tracking server"""
+    global http_session
+    if http_session is None or http_session.closed:
+        http_session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(connect=CLICK_CONNECT_TIMEOUT, sock_read=CLICK_READ_TIMEOUT),
+            connector=aiohttp.TCPConnector(limit=8, keepalive_timeout=60)
+        )
+    return http_session
+
+class ClickIndex:
+    """Running {tg_id: {post_num}} for one session, plus the newest click id seen"""
+    
+    def __init__(self):
+        self.clicked = {}
+        self.last_id = None
+        self.synced = None
+        # None until the first fetch shows whether the server serves deltas (click ids or cursors)
+        self.incremental = None
+        self.lock = asyncio.Lock()
+    
+    def add(self, tg_id, post_num, click_id=None):
+        """Record a click; True if it is new"""
+        if click_id is not None and (self.last_id is None or click_id > self.last_id):
+            self.last_id = click_id
+        posts = self.clicked.get(tg_id)
+        if posts is None:
+            posts = self.clicked[tg_id] = set()
+        elif post_num in posts:
+            return False
+        posts.add(post_num)
+        return True
+
+async def _fetch_click_page(snum, since, cursor, index):
+    """Fetch one page (or NDJSON stream) of clicks into index; returns the next cursor"""
+    params = {"limit": CLICK_PAGE_SIZE}
+    if since is not None:
+        params["since"] = since
+    if cursor is not None:
+        params["cursor"] = cursor
+    headers = {"Accept": "application/x-ndjson, application/json"}
+    async with get_http().get(f"{SERVER_URL}/api/clicks/{snum}", params=params, headers=headers) as resp:
+        if resp.status != 200:
+            raise aiohttp.ClientResponseError(resp.request_info, resp.history, status=resp.status, headers=resp.headers)
+        if resp.content_type == "application/x-ndjson":
+            async for line in resp.content:
+                if line.strip():
+                    c = json.loads(line)
+                    index.add(c["tg_id"], c["post_num"], c.get("id"))
+            return None
+        return await _add_click_body((await resp.read()).decode(), index)
+
+CLICKS_HEAD = re.compile(r'\s*\{\s*"clicks"\s*:\s*\[')
+
+async def _add_click_body(text, index):
+    """Fold a {"clicks": [...]} body into index; returns next_cursor"""
+    # Large bodies are decoded a slice of the array at a time so handlers run in between
+    # (json.loads holds the GIL, so a worker thread would not help)
+    head = CLICKS_HEAD.match(text)
+    pos = head.end() if head and len(text) > CLICK_DECODE_INLINE else None
+    try:
+        while pos is not None:
+            end = text.rfind("},", pos, pos + CLICK_DECODE_INLINE)
+            if end < 0:
+                # Last slice: the rest of the array, then the remaining keys
+                clicks, end = json.JSONDecoder().raw_decode("[" + text[pos:])
+                tail = json.loads("{" + text[pos + end - 1:].lstrip(" \t\r\n,"))
+                for c in clicks:
+                    index.add(c["tg_id"], c["post_num"], c.get("id"))
+                return tail.get("next_cursor")
+            for c in json.loads("[" + text[pos:end + 1] + "]"):
+                index.add(c["tg_id"], c["post_num"], c.get("id"))
+            pos = end + 2
+            await asyncio.sleep(0)
+    except (ValueError, TypeError, KeyError):
+        # Not the plain layout after all - decode it whole (index.add dedupes what was added)
+        pass
+    data = json.loads(text)
+    for c in data.get("clicks", []):
+        index.add(c["tg_id"], c["post_num"], c.get("id"))
+    return data.get("next_cursor")
+
+async def fetch_clicks(snum, index):
+    """Pull clicks newer than index.last_id, page by page; False if the server is unreachable"""
+    since = index.last_id
+    cursor = None
+    paged = False
+    while True:
+        for attempt in range(CLICK_FETCH_RETRIES + 1):
+            try:
+                cursor = await _fetch_click_page(snum, since, cursor, index)
+                break
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                status = getattr(e, "status", None)
+                # Only 5xx, 429 and network errors are worth retrying; a 4xx means no clicks to score with
+                if attempt == CLICK_FETCH_RETRIES or (status and status < 500 and status != 429):
+                    return False
+                delay = 0.5 * 2 ** attempt
+                if status == 429:
+                    try:
+                        delay = min(max(delay, float(e.headers["Retry-After"])), 60.0)
+                    except (TypeError, KeyError, ValueError):
+                        pass
+                await asyncio.sleep(delay)
+        if cursor is None:
+            index.incremental = paged or index.last_id is not None
+            return True
+        paged = True
+
+def click_index(snum):
+    """Click index for a session, created on first use"""
+    index = session_clicks.get(snum)
+    if index is None:
+        index = session_clicks[snum] = ClickIndex()
+    return index
+
+async def ingest_clicks(snum):
+    """Bring a session's click index up to date; False if the fetch failed"""
+    if TRACK_PUBLIC_URL:
+        # The built-in tracker feeds the index directly
+        return True
+    index = click_index(snum)
+    async with index.lock:
+        ok = await fetch_clicks(snum, index)
+        if ok:
+            index.synced = time.time()
+        return ok
+
+def start_click_ingest(snum):
+    """Reset the click index and poll it until the session's report"""
+    global ingest_session
+    session_clicks[snum] = ClickIndex()
+    ingest_session = snum
+    click_log.reset()
+
+async def poll_clicks():
+    """Scheduler job: ingest new clicks for the session being checked"""
+    if ingest_session is None:
         return
+    index = session_clicks.get(ingest_session)
+    if index is not None and index.incremental is False:
+        # The server resends everything each time - leave it to the report-time fetch
+        return
+    await ingest_clicks(ingest_session)
+
+def engagement(posts, clicked, own):
+    """(clicked, eligible, pct) for one member; posts are the scored post numbers, own theirs or None"""
+    eligible = len(posts) - (own is not None)
+    count = len(clicked & posts) - (own in clicked)
+    pct = round(count / eligible * 100) if eligible > 0 else 0
+    return count, eligible, pct
+
+# ═══════════════════════════════════════════════════════════════
+# CLICK TRACKER
+# ═══════════════════════════════════════════════════════════════
+CLICK_RECORD = struct.Struct("<qII")  # tg_id, session, post
+TG_AUTH_FIELDS = ("auth_date", "first_name", "id", "last_name", "photo_url", "username")
+
+class ClickLog:
+    """Append-only binary click log, buffered in memory and flushed in the background"""
+    
+    def __init__(self, path):
+        self.path = path
+        self.buf = bytearray()
+        self.task = None
+    
+    def append(self, tg_id, snum, post_num):
+        self.buf += CLICK_RECORD.pack(tg_id, snum, post_num)
+    
+    def flush(self):
+        if self.path and self.buf:
+            with open(self.path, "ab") as f:
+                f.write(self.buf)
+            self.buf.clear()
+    
+    def reset(self):
+        """Start a fresh log for a new session"""
+        self.buf.clear()
+        if self.path and os.path.exists(self.path):
+            open(self.path, "wb").close()
+    
+    def load(self, snum, index):
+        """Replay logged clicks for a session into its index"""
+        if not (self.path and os.path.exists(self.path)):
+            return
+        with open(self.path, "rb") as f:
+            data = f.read()
+        usable = len(data) - len(data) % CLICK_RECORD.size
+        for tg_id, s, post_num in CLICK_RECORD.iter_unpack(data[:usable]):
+            if s == snum:
+                index.add(tg_id, post_num)
+    
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self._run())
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(1)
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"⚠️ Click log flush failed: {e}")
+
+class TokenTable:
+    """Array-backed token id -> (session serial, post, url), keeping the newest entries"""
+    
+    def __init__(self, limit):
+        self.limit = limit
+        self.base = 0
+        self.serials = array("I")
+        self.posts = array("I")
+        self.urls = []
+    
+    def add(self, serial, post_num, url):
+        tid = self.base + len(self.posts)
+        self.serials.append(serial)
+        self.posts.append(post_num)
+        self.urls.append(url)
+        store.put("tokens", tid, serial, post_num, url)
+        if len(self.posts) > self.limit + self.limit // 4:
+            drop = len(self.posts) - self.limit
+            del self.serials[:drop]
+            del self.posts[:drop]
+            del self.urls[:drop]
+            self.base += drop
+            store.prune("tokens", self.base)
+        return tid
+    
+    def get(self, tid):
+        i = tid - self.base
+        if 0 <= i < len(self.posts):
+            return self.serials[i], self.posts[i], self.urls[i]
+        return None
     
-    total = len(session_members)
-    admin_ids = await get_admin_ids(bot)
-    
-    # Fetch clicks from server
+    def load(self, rows):
+        """Restore from (id, serial, post, url) rows sorted by id"""
+        for tid, serial, post_num, url in rows[-self.limit:]:
+            if not self.posts:
+                self.base = tid
+            self.serials.append(serial)
+            self.posts.append(post_num)
+            self.urls.append(url)
+
+B62 = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+B62_INDEX = {c: i for i, c in enumerate(B62)}
+TOKEN_TAG_LEN = 6
+
+def b62(n, width=1):
+    out = []
+    while n or len(out) < width:
+        n, r = divmod(n, 62)
+        out.append(B62[r])
+    return "".join(reversed(out))
+
+def _token_tag(tid):
+    digest = hmac.new(TRACK_SECRET.encode(), str(tid).encode(), hashlib.sha256).digest()
+    return b62(int.from_bytes(digest[:4], "big"), TOKEN_TAG_LEN)
+
+def make_token(tid):
+    """Short signed token: base62 id + base62 HMAC tag"""
+    return b62(tid) + _token_tag(tid)
+
+def read_token(token):
+    """Token id, or None if malformed or tampered with"""
+    if len(token) <= TOKEN_TAG_LEN or len(token) > TOKEN_TAG_LEN + 11:
+        return None
+    tid = 0
+    for c in token[:-TOKEN_TAG_LEN]:
+        i = B62_INDEX.get(c)
+        if i is None:
+            return None
+        tid = tid * 62 + i
+    if not hmac.compare_digest(_token_tag(tid), token[-TOKEN_TAG_LEN:]):
+        return None
+    return tid
+
+tokens = TokenTable(TRACK_TOKEN_LIMIT)
+click_log = ClickLog(TRACK_LOG if TRACK_PUBLIC_URL else "")
+tracker_runner = None
+_tg_auth_key = hashlib.sha256(TOKEN.encode()).digest()
+
+def verify_tg_auth(q):
+    """Check Telegram login data appended to a login_url; returns the user id or None"""
+    received = q.get("hash")
+    if not received or "id" not in q:
+        return None
+    check = "\n".join(f"{k}={q[k]}" for k in TG_AUTH_FIELDS if k in q)
+    expected = hmac.new(_tg_auth_key, check.encode(), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(expected, received):
+        return None
     try:
-        async with aiohttp.ClientSession() as sess:
-            async with sess.get(f"{SERVER_URL}/api/clicks/{snum}") as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    clicks = data.get("clicks", [])
-                else:
-                    clicks = []
-    except:
-        clicks = []
-    
-    # Process click data
-    user_clicked = {}
-    for c in clicks:
-        user_clicked.setdefault(c["tg_id"], set()).add(c["post_num"])
-    
+        if time.time() - int(q.get("auth_date", 0)) > TRACK_AUTH_MAX_AGE:
+            return None
+        return int(q["id"])
+    except ValueError:
+        return None
+
+async def track_handler(request):
+    """Record a click and redirect to the post"""
+    tid = read_token(request.match_info["token"])
+    entry = tokens.get(tid) if tid is not None else None
+    if not entry:
+        return web.Response(status=404)
+    serial, post_num, url = entry
+    
+    tg_id = verify_tg_auth(request.query)
+    if tg_id is not None and serial == session_serial and session_posts.poster(post_num):
+        if click_index(session_number).add(tg_id, post_num):
+            click_log.append(tg_id, session_number, post_num)
+    raise web.HTTPFound(url)
+
+async def start_tracker():
+    """Serve /track in-process"""
+    global tracker_runner
+    click_log.load(session_number, click_index(session_number))
+    click_log.start()
+    web_app = web.Application()
+    web_app.router.add_get("/t/{token}", track_handler)
+    tracker_runner = web.AppRunner(web_app, access_log=None)
+    await tracker_runner.setup()
+    await web.TCPSite(tracker_runner, TRACK_LISTEN, TRACK_PORT).start()
+    print(f"✅ Click tracker listening on {TRACK_LISTEN}:{TRACK_PORT}")
+
+def engage_button(post_num, link, x_username, poster_id):
+    """'Visit & Engage' button pointing at the tracker"""
+    if TRACK_PUBLIC_URL:
+        url = f"{TRACK_PUBLIC_URL}/t/{make_token(tokens.add(session_serial, post_num, link.url))}"
+        return InlineKeyboardButton("✅ Visit & Engage", login_url=LoginUrl(url, request_write_access=False))
+    url = f"{SERVER_URL}/track?uid={poster_id}&post={post_num}&sess={session_number}&x={quote(x_username)}&link={quote(link.url)}"
+    return InlineKeyboardButton("✅ Visit & Engage", url=url)
+
+# ═══════════════════════════════════════════════════════════════
+# REPORT GENERATION
+# ═══════════════════════════════════════════════════════════════
+Report = namedtuple("Report", "snum text summary non_engaged")
+
+def render_report(snum, rows, user_clicked, names, admin_ids):
+    """Score (uid, post number, X handle) rows and render the report text in one pass"""
+    total = len(rows)
+    # Clicks on posts outside the report (replaced after a delete) don't count
+    posts = frozenset(own for _, own, _ in rows)
     engaged, non_engaged = [], []
     
-    for uid in session_members:
-        own = {pn for pn, inf in session_links.items() if inf["poster_id"] == uid}
-        eligible = total - len(own)
-        clicked = user_clicked.get(uid, set()) - own
-        count = len(clicked)
-        pct = round(count / eligible * 100) if eligible > 0 else 0
-        
-        cached = user_cache.get(uid)
-        tg_name = f"@{cached.username}" if (cached and cached.username) else (cached.full_name if cached else f"User{uid}")
-        
-        x_name = "?"
-        for pn, inf in session_links.items():
-            if inf["poster_id"] == uid:
-                x_name = f"@{inf['x_username']}"
-                break
+    for uid, own, handle in rows:
+        count, eligible, pct = engagement(posts, user_clicked.get(uid, EMPTY), own)
+        tg_name = names.get(uid) or f"User{uid}"
+        x_name = f"@{handle}" if handle else "?"
         
         if pct >= ENGAGE_THRESHOLD:
             engaged.append((tg_name, x_name, pct, count, eligible))
         else:
             non_engaged.append((uid, tg_name, x_name, pct, count, eligible))
     
-    # Build report message
-    lines = [f"📊 Session {snum} — Engagement Report\n", f"Total Posts: {total}\n"]
+    out = io.StringIO()
+    out.write(f"📊 Session {snum} — Engagement Report\n\nTotal Posts: {total}\n\n")
     
     if engaged:
-        lines.append("✅ Engaged Members:")
+        out.write("✅ Engaged Members:\n")
         for tg, x, p, c, e in sorted(engaged, key=lambda i: i[2], reverse=True):
             star = " ⭐" if p == 100 else ""
-            lines.append(f"  • {tg} ({x}) — {c}/{e} ({p}%){star}")
+            out.write(f"  • {tg} ({x}) — {c}/{e} ({p}%){star}\n")
     else:
-        lines.append("✅ Engaged: None")
+        out.write("✅ Engaged: None\n")
     
-    lines.append("")
+    out.write("\n")
     
+    listed = 0
     if non_engaged:
-        lines.append(f"❌ Non-Engagers (below {ENGAGE_THRESHOLD}%):")
+        out.write(f"❌ Non-Engagers (below {ENGAGE_THRESHOLD}%):\n")
         for uid, tg, x, p, c, e in non_engaged:
             if uid in admin_ids:
                 continue
-            lines.append(f"  • {tg} ({x}) — {c}/{e} ({p}%)")
+            listed += 1
+            out.write(f"  • {tg} ({x}) — {c}/{e} ({p}%)\n")
     else:
-        lines.append("❌ Non-Engagers: None 🎉")
+        out.write("❌ Non-Engagers: None 🎉\n")
+    
+    summary = (
+        f"📊 Session {snum} — Engagement Report\n\n"
+        f"Total Posts: {total}\n"
+        f"✅ Engaged: {len(engaged)}\n"
+        f"❌ Non-Engagers: {listed}\n\n"
+        f"📎 Full report attached"
+    )
+    return Report(snum, out.getvalue().rstrip("\n"), summary, non_engaged)
+
+async def send_report(bot, cid, tid, report):
+    """Send a report inline, or as a summary with the full text attached when it is too long"""
+    if len(report.text) <= REPORT_INLINE_LIMIT:
+        await dispatch(LANE_NOTICE, cid, bot.send_message, chat_id=cid, message_thread_id=tid, text=report.text)
+        return
+    await dispatch(
+        LANE_NOTICE, cid, bot.send_document,
+        chat_id=cid,
+        message_thread_id=tid,
+        document=report.text.encode(),
+        filename=f"session_{report.snum}_report.txt",
+        caption=report.summary
+    )
+
+def member_names(uids):
+    """Report names from the user cache"""
+    names = {}
+    for uid in uids:
+        cached = user_cache.get(uid)
+        names[uid] = display_name(cached) if cached else f"User{uid}"
+    return names
+
+async def build_report(bot, cid, tid, snum, do_warn=True):
+    """Generate engagement report"""
+    if not session_posts.members():
+        await dispatch(LANE_NOTICE, cid, bot.send_message, chat_id=cid, message_thread_id=tid, text=f"📊 Session {snum} — No posts")
+        return
     
-    report = "\n".join(lines)
+    admin_ids = await get_admin_ids(bot)
     
-    # Send report (handle long messages)
-    if len(report) <= 4096:
-        await bot.send_message(chat_id=cid, message_thread_id=tid, text=report)
-    else:
-        chunk = ""
-        for line in lines:
-            if len(chunk) + len(line) + 1 > 4096:
-                await bot.send_message(chat_id=cid, message_thread_id=tid, text=chunk)
-                chunk = line + "\n"
-            else:
-                chunk += line + "\n"
-        if chunk:
-            await bot.send_message(chat_id=cid, message_thread_id=tid, text=chunk)
+    # Catch up on clicks since the last poll - usually a small delta
+    if not await ingest_clicks(snum):
+        print(f"⚠️ Click fetch failed for session {snum} - skipping auto-warn")
+        do_warn = False
+    user_clicked = session_clicks[snum].clicked
+    
+    names = member_names(session_posts.members())
+    report = render_report(snum, session_posts.rows(), user_clicked, names, admin_ids)
+    await send_report(bot, cid, tid, report)
     
     # Auto-warn non-engagers
     if not do_warn:
         return
     
-    for uid, tg, x, p, c, e in non_engaged:
-        if uid in admin_ids:
-            continue
-        
+    targets = [(uid, tg) for uid, tg, x, p, c, e in report.non_engaged if uid not in admin_ids]
+    await enforce_non_engagers(bot, cid, snum, targets)
+
+# ═══════════════════════════════════════════════════════════════
+# SESSION ARCHIVE
+# ═══════════════════════════════════════════════════════════════
+class Snapshot:
+    """Immutable record of a closed session"""
+    __slots__ = ("serial", "snum", "closed", "rows", "clicked", "names", "admins", "rendered")
+    
+    def encode(self):
+        rows = [[uid, self.names[uid], handle, own, sorted(self.clicked.get(uid, EMPTY))] for uid, own, handle in self.rows]
+        return zlib.compress(json.dumps({"m": rows, "a": sorted(self.admins)}, separators=(",", ":")).encode())
+    
+    @classmethod
+    def decode(cls, serial, snum, closed, blob):
+        data = json.loads(zlib.decompress(blob))
+        snap = cls()
+        snap.serial, snap.snum, snap.closed = serial, snum, closed
+        snap.rows = tuple((r[0], r[3], r[2]) for r in data["m"])
+        snap.names = {r[0]: r[1] for r in data["m"]}
+        snap.clicked = {r[0]: frozenset(r[4]) for r in data["m"] if r[4]}
+        snap.admins = frozenset(data["a"])
+        snap.rendered = None
+        return snap
+    
+    def report(self):
+        """Rendered report, built once"""
+        if self.rendered is None:
+            self.rendered = render_report(self.snum, self.rows, self.clicked, self.names, self.admins)
+        return self.rendered
+
+class SessionArchive:
+    """Closed sessions by serial; blobs live in the state store (or memory without one)"""
+    
+    def __init__(self, keep, cached=4):
+        self.keep = keep
+        self.cached = cached
+        self.latest = {}  # session number -> newest archived serial
+        self.blobs = {}  # serial -> (snum, closed, blob) when there is no state store
+        self.snaps = OrderedDict()  # recently used decoded snapshots
+    
+    def load(self, rows):
+        for serial, snum in rows:
+            self.latest[snum] = serial
+    
+    def has(self, serial):
+        return serial in self.snaps or serial in self.blobs or serial in self.latest.values()
+    
+    def freeze(self, serial, snum, admin_ids):
+        """Snapshot the current session's members, posts and clicks"""
+        index = session_clicks.get(snum)
+        snap = Snapshot()
+        snap.serial, snap.snum, snap.closed = serial, snum, time.time()
+        snap.rows = tuple(session_posts.rows())
+        snap.names = member_names(session_posts.members())
+        clicked = index.clicked if index else {}
+        snap.clicked = {uid: frozenset(clicked[uid]) for uid, _, _ in snap.rows if uid in clicked}
+        snap.admins = frozenset(admin_ids)
+        snap.rendered = None
+        blob = snap.encode()
+        if store.db:
+            store.put("archive", serial, snum, snap.closed, blob)
+            store.prune("archive", serial - self.keep + 1)
+        else:
+            self.blobs[serial] = (snum, snap.closed, blob)
+            for old in [s for s in self.blobs if s <= serial - self.keep]:
+                del self.blobs[old]
+        self.latest[snum] = serial
+        self._remember(snap)
+        return snap
+    
+    def _remember(self, snap):
+        self.snaps[snap.serial] = snap
+        self.snaps.move_to_end(snap.serial)
+        while len(self.snaps) > self.cached:
+            self.snaps.popitem(last=False)
+    
+    async def get(self, snum):
+        """Newest archived snapshot for a session number, or None"""
+        serial = self.latest.get(snum)
+        if serial is None:
+            return None
+        snap = self.snaps.get(serial)
+        if snap is not None:
+            self.snaps.move_to_end(serial)
+            return snap
+        if serial in self.blobs:
+            row = self.blobs[serial]
+        elif store.db:
+            row = await store.fetchone("SELECT snum, closed, data FROM archive WHERE serial = ?", (serial,))
+        else:
+            row = None
+        if row is None:
+            return None
+        snap = Snapshot.decode(serial, *row)
+        self._remember(snap)
+        return snap
+
+archive = SessionArchive(ARCHIVE_KEEP)
+
+def archive_session(admin_ids):
+    """Freeze the current session once it has posts"""
+    if session_posts.members() and not archive.has(session_serial):
+        archive.freeze(session_serial, session_number, admin_ids)
+
+# ═══════════════════════════════════════════════════════════════
+# ENFORCEMENT
+# ═══════════════════════════════════════════════════════════════
+ENFORCE_NOTES = {"warn": "", "mute": "\n🔕 Muted For 1 Day", "remove": "\n🚫 Removed From Group"}
+
+async def _enforce_one(bot, cid, snum, uid, tg, stats, digest):
+    """Warn one member once per session; safe to re-run after a crash"""
+    key = f"{session_serial}:{uid}"
+    rec = enforcement.get(key)
+    if rec and rec[1] == "done":
+        stats["skipped"] += 1
+        return
+    if rec is None:
+        # Count the warning and record the action together so a retry never double-warns
         warnings[uid] = warnings.get(uid, 0) + 1
-        wc = warnings[uid]
-        
-        try:
-            if wc == 2:
+        rec = enforcement[key] = [warnings[uid], "pending"]
+        store.put("warnings", uid, warnings[uid])
+        store.put("enforcement", key, rec[0], rec[1])
+    
+    wc = rec[0]
+    action = "mute" if wc == 2 else "remove" if wc >= 4 else "warn"
+    try:
+        # "acted" = moderation applied, notice not yet sent - a re-run only resends the notice
+        if rec[1] != "acted":
+            if action == "mute":
                 until = datetime.datetime.now() + datetime.timedelta(days=1)
-                await bot.restrict_chat_member(cid, uid, permissions=ChatPermissions(can_send_messages=False), until_date=until)
-                await send_warn_msg(bot, f"🚨 User — {tg}\n\n❌ Warned For Not Engaging In Session {snum}\n\n>> Warning {wc}/4\n🔕 Muted For 1 Day")
-            elif wc >= 4:
-                await bot.ban_chat_member(cid, uid)
-                await bot.unban_chat_member(cid, uid)
-                await send_warn_msg(bot, f"🚨 User — {tg}\n\n❌ Warned For Not Engaging In Session {snum}\n\n>> Warning {wc}/4\n🚫 Removed From Group")
-            else:
-                await send_warn_msg(bot, f"🚨 User — {tg}\n\n❌ Warned For Not Engaging In Session {snum}\n\n>> Warning {wc}/4")
-        except:
-            pass
+                await dispatch(LANE_MODERATION, cid, bot.restrict_chat_member, cid, uid, permissions=ChatPermissions(can_send_messages=False), until_date=until)
+            elif action == "remove":
+                await dispatch(LANE_MODERATION, cid, bot.ban_chat_member, cid, uid)
+                await dispatch(LANE_MODERATION, cid, bot.unban_chat_member, cid, uid)
+            rec[1] = "acted"
+            store.put("enforcement", key, wc, rec[1])
+        stats[action]["ok"] += 1
+        if digest is not None:
+            # Marked done once the digest message carrying this line is sent
+            digest.append((f"• {tg} — Warning {wc}/4{ENFORCE_NOTES[action].replace(chr(10), ' ')}", key))
+            return
+        await send_warn_msg(bot, f"🚨 User — {tg}\n\n❌ Warned For Not Engaging In Session {snum}\n\n>> Warning {wc}/4{ENFORCE_NOTES[action]}")
+        rec[1] = "done"
+    except Exception as e:
+        if rec[1] == "acted":
+            print(f"⚠️ Warning notice failed for {uid}: {type(e).__name__}: {e}")
+        else:
+            rec[1] = "failed"
+            stats[action]["failed"] += 1
+            if digest is not None:
+                digest.append((f"• {tg} — Warning {wc}/4 ⚠️ {action} failed", None))
+            print(f"⚠️ Enforcement {action} failed for {uid}: {type(e).__name__}: {e}")
+    store.put("enforcement", key, wc, rec[1])
+
+async def _send_digest_chunk(bot, text, keys):
+    """Send one digest message, then mark the members it names as done"""
+    try:
+        await send_warn_msg(bot, text)
+    except Exception as e:
+        # Their records stay "acted", so a re-run sends the notice again
+        print(f"⚠️ Warning digest failed: {type(e).__name__}: {e}")
+        return
+    for key in keys:
+        rec = enforcement.get(key)
+        if rec and rec[1] == "acted":
+            rec[1] = "done"
+            store.put("enforcement", key, rec[0], rec[1])
+
+async def enforce_non_engagers(bot, cid, snum, targets):
+    """Warn/mute/remove non-engagers with bounded concurrency"""
+    stats = {"skipped": 0, **{a: {"ok": 0, "failed": 0} for a in ENFORCE_NOTES}}
+    digest = [] if ENFORCE_DIGEST else None
+    slots = asyncio.Semaphore(ENFORCE_CONCURRENCY)
+    
+    async def run(uid, tg):
+        async with slots:
+            await _enforce_one(bot, cid, snum, uid, tg, stats, digest)
+    
+    await asyncio.gather(*(run(uid, tg) for uid, tg in targets))
+    
+    summary = ", ".join(f"{a} {stats[a]['ok']}/{stats[a]['ok'] + stats[a]['failed']}" for a in ENFORCE_NOTES)
+    print(f"🚨 Session {snum} enforcement: {summary}, skipped {stats['skipped']}")
+    
+    if digest:
+        lines = [(f"🚨 Session {snum} — Non-Engagement Warnings\n", None)] + sorted(digest, key=lambda d: d[0]) + [(f"\n>> Actions: {summary}", None)]
+        chunk = ""
+        keys = []
+        for line, key in lines:
+            if len(chunk) + len(line) + 1 > 4096:
+                await _send_digest_chunk(bot, chunk, keys)
+                chunk = ""
+                keys = []
+            chunk += line + "\n"
+            if key:
+                keys.append(key)
+        if chunk:
+            await _send_digest_chunk(bot, chunk, keys)
+    return stats
 
 # ═══════════════════════════════════════════════════════════════
 # SESSION MANAGEMENT
 # ═══════════════════════════════════════════════════════════════
 def _clear_session():
     """Clear session data"""
-    user_posts.clear()
-    posted_links.clear()
-    session_members.clear()
-    session_links.clear()
-    global counter
+    # Sessions closed without a scheduled report are archived as they stand
+    entry = admin_cache.get(CHAT_ID)
+    archive_session(entry[1] if entry else ())
+    session_posts.clear()
+    global counter, session_serial
     counter = 1
+    session_serial += 1
+    enforcement.clear()
+    store.clear("enforcement")
+    save_kv()
 
 # ═══════════════════════════════════════════════════════════════
 # AUTOMATED SCHEDULER JOBS
 # ═══════════════════════════════════════════════════════════════
+def mark_run(stage):
+    """Remember when a session stage last ran so catch-up never repeats it"""
+    job_runs[stage] = time.time()
+    store.put("kv", f"ran_{stage}", job_runs[stage])
+
+def opened_this_cycle(sess_num, now=None):
+    """Whether sess_num is the current session and opened at or after its latest scheduled open"""
+    sched = SCHEDULE_IST[SESSION_NUMBERS.index(sess_num)]
+    return session_number == sess_num and job_runs.get("open", 0) >= last_ist(sched["open"], now)
+
+def session_phase(now=None):
+    """(session number, stage, due epoch) of the schedule event most recently due"""
+    best = None
+    for idx, sched in enumerate(SCHEDULE_IST):
+        for stage in ("open", "close", "check", "report"):
+            due = last_ist(sched[stage], now)
+            if best is None or due > best[2]:
+                best = (SESSION_NUMBERS[idx], stage, due)
+    return best
+
 async def auto_open(sess_num):
     """Auto-open session with correct session number"""
     global session_open, session_number
-    if not auto_sessions_enabled:
+    if not auto_sessions_enabled or opened_this_cycle(sess_num):
         return
     
     _clear_session()
     session_open = True
     session_number = sess_num  # Set correct session number
+    mark_run("open")
+    save_kv()
+    start_click_ingest(session_number)
     
     # Open topic
     try:
-        await bot_instance.reopen_forum_topic(chat_id=CHAT_ID, message_thread_id=POST_TOPIC_ID)
+        await dispatch(LANE_POST, CHAT_ID, bot_instance.reopen_forum_topic, chat_id=CHAT_ID, message_thread_id=POST_TOPIC_ID)
     except:
         pass
     
     # Send opening message
-    sent = await bot_instance.send_message(
+    sent = await dispatch(
+        LANE_POST, CHAT_ID, bot_instance.send_message,
         chat_id=CHAT_ID,
         message_thread_id=POST_TOPIC_ID,
         text=f"❑ Session {session_number} Started Now ❑\n\n✅ Start Posting Your Links Now"
@@ -378,11 +2001,14 @@ async def auto_close():
     """Auto-close session"""
     global session_open
     session_open = False
-    total = len(user_posts)
+    mark_run("close")
+    save_kv()
+    total = session_posts.sent
     
     # Send closing message
     timings = timing_text_ist()
-    sent = await bot_instance.send_message(
+    sent = await dispatch(
+        LANE_POST, CHAT_ID, bot_instance.send_message,
         chat_id=CHAT_ID,
         message_thread_id=POST_TOPIC_ID,
         text=f"""❑ Session {session_number} Closed Now ❑
@@ -402,13 +2028,14 @@ async def auto_close():
     
     # Close topic
     try:
-        await bot_instance.close_forum_topic(chat_id=CHAT_ID, message_thread_id=POST_TOPIC_ID)
+        await dispatch(LANE_POST, CHAT_ID, bot_instance.close_forum_topic, chat_id=CHAT_ID, message_thread_id=POST_TOPIC_ID)
     except:
         pass
 
 async def pre_check():
     """Pre-check warning"""
-    sent = await bot_instance.send_message(
+    sent = await dispatch(
+        LANE_NOTICE, CHAT_ID, bot_instance.send_message,
         chat_id=CHAT_ID,
         message_thread_id=POST_TOPIC_ID,
         text=f"✅ It's Checking Time Now For Session {session_number} ✅"
@@ -417,13 +2044,48 @@ async def pre_check():
 
 async def generate_report():
     """Generate and send report"""
+    global ingest_session
     await send_leaderboard(bot_instance, CHAT_ID, POST_TOPIC_ID, session_number)
     await build_report(bot_instance, CHAT_ID, POST_TOPIC_ID, session_number, do_warn=True)
+    ingest_session = None
+    archive_session(await get_admin_ids(bot_instance))
+    mark_run("report")
+
+async def scheduled_report(sess_num):
+    """Report job: only for a session that actually opened, and once per cycle"""
+    sched = SCHEDULE_IST[SESSION_NUMBERS.index(sess_num)]
+    if not opened_this_cycle(sess_num):
+        print(f"⏭ Session {sess_num} did not open this cycle - no report")
+        return
+    if job_runs.get("report", 0) >= last_ist(sched["report"]):
+        return
+    await generate_report()
+
+async def catch_up_schedule():
+    """Run the open/close/report a restart skipped, from where the clock is in the schedule"""
+    if not auto_sessions_enabled:
+        return
+    snum, stage, due = session_phase()
+    if stage == "open":
+        if not opened_this_cycle(snum):
+            print(f"⏩ Catch-up: opening session {snum}")
+            await auto_open(snum)
+        return
+    if not opened_this_cycle(snum):
+        # The whole posting window was missed - nothing to close or score
+        return
+    if session_open:
+        print(f"⏩ Catch-up: closing session {snum}")
+        await auto_close()
+    if stage == "report" and job_runs.get("report", 0) < due:
+        print(f"⏩ Catch-up: report for session {snum}")
+        await generate_report()
 
 async def notify_10min(next_sess_num):
     """10 minute notification with correct next session number"""
     next_s = next_sess_num
-    sent = await bot_instance.send_message(
+    sent = await dispatch(
+        LANE_NOTICE, CHAT_ID, bot_instance.send_message,
         chat_id=CHAT_ID,
         message_thread_id=POST_TOPIC_ID,
         text=f"⚡️ **ATTENTION ALL MEMBERS** ⚡️\n\n❑ Session {next_s} Starting In 10 Minutes Be Ready With Your Links",
@@ -434,7 +2096,8 @@ async def notify_10min(next_sess_num):
 async def notify_5min(next_sess_num):
     """5 minute notification with correct next session number"""
     next_s = next_sess_num
-    sent = await bot_instance.send_message(
+    sent = await dispatch(
+        LANE_NOTICE, CHAT_ID, bot_instance.send_message,
         chat_id=CHAT_ID,
         message_thread_id=POST_TOPIC_ID,
         text=f"⚡️ **ATTENTION ALL MEMBERS** ⚡️\n\n❑ Session {next_s} Starting In 5 Minutes Be Ready With Your Links",
@@ -442,6 +2105,204 @@ async def notify_5min(next_sess_num):
     )
     track_msg(POST_TOPIC_ID, sent.message_id)
 
+# ═══════════════════════════════════════════════════════════════
+# TOPIC PURGE
+# ═══════════════════════════════════════════════════════════════
+def save_clear_jobs():
+    """Persist unfinished /clear jobs"""
+    if not CLEAR_QUEUE_FILE:
+        return
+    tmp = CLEAR_QUEUE_FILE + ".tmp"
+    try:
+        with open(tmp, "w") as f:
+            json.dump([[tid, ids.tolist()] for tid, ids in clear_jobs.items()], f)
+        os.replace(tmp, CLEAR_QUEUE_FILE)
+    except OSError:
+        pass
+
+def restore_clear_jobs(bot):
+    """Resume /clear jobs interrupted by a restart"""
+    if not (CLEAR_QUEUE_FILE and os.path.exists(CLEAR_QUEUE_FILE)):
+        return
+    try:
+        with open(CLEAR_QUEUE_FILE) as f:
+            jobs = json.load(f)
+    except (OSError, ValueError):
+        return
+    for tid, ids in jobs:
+        clear_jobs.setdefault(tid, array("q")).extend(ids)
+        clear_tasks[tid] = asyncio.ensure_future(purge_topic(bot, tid))
+
+async def purge_topic(bot, tid):
+    """Delete a topic's tracked messages in bulk with progress updates"""
+    ids = clear_jobs[tid]
+    done = 0
+    progress = None
+    try:
+        progress = await dispatch(
+            LANE_NOTICE, CHAT_ID, bot.send_message,
+            chat_id=CHAT_ID, message_thread_id=tid, text=f"🧹 Clearing {len(ids)} messages..."
+        )
+    except:
+        pass
+    
+    last_edit = time.monotonic()
+    failures = 0
+    while ids:
+        batch = ids[:DELETE_BATCH_SIZE].tolist()
+        try:
+            await dispatch(LANE_NOTICE, CHAT_ID, bot.delete_messages, CHAT_ID, batch)
+        except BadRequest:
+            # Nothing in the batch is deletable any more (too old or already gone)
+            pass
+        except Exception:
+            failures += 1
+            if failures >= 3:
+                break
+            await asyncio.sleep(2 ** failures)
+            continue
+        failures = 0
+        del ids[:len(batch)]
+        done += len(batch)
+        save_clear_jobs()
+        
+        if progress and ids and time.monotonic() - last_edit >= 3:
+            last_edit = time.monotonic()
+            try:
+                await dispatch(
+                    LANE_NOTICE, CHAT_ID, bot.edit_message_text,
+                    f"🧹 Clearing... {done}/{done + len(ids)}",
+                    chat_id=CHAT_ID, message_id=progress.message_id
+                )
+            except:
+                pass
+    
+    if ids:
+        # Leave the rest in clear_jobs so the next /clear (or restart) resumes
+        if progress:
+            try:
+                await dispatch(
+                    LANE_NOTICE, CHAT_ID, bot.edit_message_text,
+                    f"⚠️ Clear interrupted — {len(ids)} left, run /clear to resume",
+                    chat_id=CHAT_ID, message_id=progress.message_id
+                )
+            except:
+                pass
+        return
+    
+    clear_jobs.pop(tid, None)
+    save_clear_jobs()
+    if progress:
+        auto_delete_message(bot, CHAT_ID, progress.message_id, 0)
+
+# ═══════════════════════════════════════════════════════════════
+# PROFILING
+# ═══════════════════════════════════════════════════════════════
+class Profiler:
+    """cProfile and tracemalloc sessions started on demand - nothing is hooked while off"""
+    
+    def __init__(self):
+        self.prof = None
+        self.started = 0
+        self.stop_task = None
+        self.snapshot = None
+    
+    def _path(self, kind, ext):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        return os.path.join(PROFILE_DIR, f"{kind}_{datetime.datetime.now():%Y%m%d_%H%M%S_%f}.{ext}")
+    
+    def start_cpu(self):
+        self.prof = cProfile.Profile()
+        self.started = time.monotonic()
+        self.prof.enable()
+    
+    def stop_cpu(self):
+        """Save the .prof file; returns (path, top functions by cumulative time)"""
+        prof, self.prof = self.prof, None
+        prof.disable()
+        path = self._path("cpu", "prof")
+        prof.dump_stats(path)
+        out = io.StringIO()
+        out.write(f"CPU profile — {time.monotonic() - self.started:.1f}s\n")
+        pstats.Stats(prof, stream=out).sort_stats("cumulative").print_stats(PROFILE_TOP)
+        return path, out.getvalue()
+    
+    def mem_snapshot(self):
+        """Start tracing, or diff against the previous snapshot; returns (path, report) or None on start"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+            self.snapshot = tracemalloc.take_snapshot()
+            return None
+        snap = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [
+            f"Memory — traced {current / 1e6:.1f}MB (peak {peak / 1e6:.1f}MB)",
+            f"user_cache: {len(user_cache)} users",
+            f"topic_messages: {sum(len(ids) for ids in topic_messages.values())} ids in {len(topic_messages)} topics",
+            f"session posts: {len(session_posts)}, archived snapshots cached: {len(archive.snaps)}",
+            "",
+            "Top growth since the previous snapshot:",
+        ]
+        lines += [str(stat) for stat in snap.compare_to(self.snapshot, "lineno")[:PROFILE_TOP]]
+        self.snapshot = snap
+        path = self._path("mem", "txt")
+        report = "\n".join(lines)
+        with open(path, "w") as f:
+            f.write(report)
+        return path, report
+    
+    def mem_stop(self):
+        tracemalloc.stop()
+        self.snapshot = None
+
+profiler = Profiler()
+
+async def send_profile(bot, path, report, caption):
+    """Post a profiling report to the warn topic as a document"""
+    kwargs = {"chat_id": CHAT_ID, "document": report.encode(), "filename": os.path.splitext(os.path.basename(path))[0] + ".txt", "caption": caption}
+    if WARN_TOPIC_ID:
+        kwargs["message_thread_id"] = WARN_TOPIC_ID
+    try:
+        await dispatch(LANE_NOTICE, CHAT_ID, bot.send_document, **kwargs)
+    except Exception as e:
+        print(f"⚠️ Profile upload failed: {type(e).__name__}: {e}")
+
+async def toggle_profile(bot, seconds=0):
+    """Start CPU profiling (optionally for a fixed time), or stop it and post the results"""
+    if profiler.prof is None:
+        profiler.start_cpu()
+        if seconds:
+            profiler.stop_task = asyncio.ensure_future(_stop_profile_later(bot, seconds))
+            return f"🔬 CPU profiling for {seconds}s"
+        return "🔬 CPU profiling started — /profile again to stop"
+    if profiler.stop_task and not profiler.stop_task.done() and profiler.stop_task is not asyncio.current_task():
+        profiler.stop_task.cancel()
+    profiler.stop_task = None
+    path, report = profiler.stop_cpu()
+    await send_profile(bot, path, report, f"🔬 CPU profile saved to {path}")
+    return f"🔬 CPU profile saved to {path}"
+
+async def _stop_profile_later(bot, seconds):
+    await asyncio.sleep(seconds)
+    if profiler.prof is not None:
+        print(await toggle_profile(bot))
+
+async def memory_snapshot(bot):
+    """Start allocation tracing, or post the top allocations since the last snapshot"""
+    result = profiler.mem_snapshot()
+    if result is None:
+        return "🧠 Memory tracing started — /memsnap again for allocation growth"
+    path, report = result
+    await send_profile(bot, path, report, f"🧠 Memory snapshot saved to {path}")
+    return f"🧠 Memory snapshot saved to {path}"
+
+def on_profile_signal(sig):
+    """SIGUSR1 toggles CPU profiling, SIGUSR2 takes a memory snapshot"""
+    async def run():
+        text = await (toggle_profile(bot_instance) if sig == signal.SIGUSR1 else memory_snapshot(bot_instance))
+        print(text)
+    asyncio.ensure_future(run())
+
 # ═══════════════════════════════════════════════════════════════
 # COMMAND HANDLERS - RESTRICTED TO POST TOPIC
 # ═══════════════════════════════════════════════════════════════
@@ -455,18 +2316,21 @@ async def startsession(update, context):
     global session_open
     _clear_session()
     session_open = True
+    mark_run("open")
+    save_kv()
+    start_click_ingest(session_number)
     
     # Open topic
     try:
-        await context.bot.reopen_forum_topic(chat_id=CHAT_ID, message_thread_id=POST_TOPIC_ID)
+        await dispatch(LANE_POST, CHAT_ID, context.bot.reopen_forum_topic, chat_id=CHAT_ID, message_thread_id=POST_TOPIC_ID)
     except:
         pass
     
-    reply = await update.message.reply_text(f"❑ Session {session_number} Started Now ❑\n\n✅ Start Posting Your Links Now")
+    reply = await dispatch(LANE_POST, CHAT_ID, update.message.reply_text, f"❑ Session {session_number} Started Now ❑\n\n✅ Start Posting Your Links Now")
     
     # Auto-delete command and reply
-    asyncio.create_task(auto_delete_after(context, CHAT_ID, update.message.message_id, 10))
-    asyncio.create_task(auto_delete_after(context, CHAT_ID, reply.message_id, 10))
+    auto_delete_after(context, CHAT_ID, update.message.message_id, 10)
+    auto_delete_after(context, CHAT_ID, reply.message_id, 10)
 
 async def endsession(update, context):
     """End session manually (POST_TOPIC_ID only)"""
@@ -477,10 +2341,12 @@ async def endsession(update, context):
     
     global session_open
     session_open = False
-    total = len(user_posts)
+    save_kv()
+    total = session_posts.sent
     
     timings = timing_text_ist()
-    reply = await update.message.reply_text(
+    reply = await dispatch(
+        LANE_POST, CHAT_ID, update.message.reply_text,
         f"""❑ Session {session_number} Closed Now ❑
 
 > Total Links - {total}
@@ -497,13 +2363,13 @@ async def endsession(update, context):
     
     # Close topic
     try:
-        await context.bot.close_forum_topic(chat_id=CHAT_ID, message_thread_id=POST_TOPIC_ID)
+        await dispatch(LANE_POST, CHAT_ID, context.bot.close_forum_topic, chat_id=CHAT_ID, message_thread_id=POST_TOPIC_ID)
     except:
         pass
     
     # Auto-delete command and reply
-    asyncio.create_task(auto_delete_after(context, CHAT_ID, update.message.message_id, 10))
-    asyncio.create_task(auto_delete_after(context, CHAT_ID, reply.message_id, 10))
+    auto_delete_after(context, CHAT_ID, update.message.message_id, 10)
+    auto_delete_after(context, CHAT_ID, reply.message_id, 10)
 
 async def report_cmd(update, context):
     """Generate report (POST_TOPIC_ID only)"""
@@ -513,10 +2379,36 @@ async def report_cmd(update, context):
         return
     
     sess = int(context.args[0]) if (context.args and context.args[0].isdigit()) else session_number
-    await build_report(context.bot, CHAT_ID, POST_TOPIC_ID, sess, do_warn=False)
+    snap = None if sess == session_number else await archive.get(sess)
+    if snap:
+        await send_report(context.bot, CHAT_ID, POST_TOPIC_ID, snap.report())
+    elif sess == session_number:
+        await build_report(context.bot, CHAT_ID, POST_TOPIC_ID, sess, do_warn=False)
+    else:
+        await dispatch(LANE_NOTICE, CHAT_ID, context.bot.send_message, chat_id=CHAT_ID, message_thread_id=POST_TOPIC_ID, text=f"📊 Session {sess} — No archived report")
     
     # Auto-delete command
-    asyncio.create_task(auto_delete_after(context, CHAT_ID, update.message.message_id, 10))
+    auto_delete_after(context, CHAT_ID, update.message.message_id, 10)
+
+async def progress_cmd(update, context):
+    """Show engagement progress from the running click index"""
+    uid = update.effective_user.id
+    index = session_clicks.get(session_number)
+    clicked = index.clicked if index else {}
+    members = session_posts.members()
+    posts = frozenset(members.values())
+    count, eligible, pct = engagement(posts, clicked.get(uid, EMPTY), members.get(uid))
+    
+    lines = [f"📈 Session {session_number} Progress\n", f"You: {count}/{eligible} ({pct}%)"]
+    if await is_admin(update, context):
+        done = sum(1 for m, pn in members.items() if engagement(posts, clicked.get(m, EMPTY), pn)[2] >= ENGAGE_THRESHOLD)
+        lines.append(f"Engaged Members: {done}/{len(members)}")
+    if index and index.synced:
+        lines.append(f"\n🕒 Updated {int(time.time() - index.synced)}s ago")
+    
+    reply = await dispatch(LANE_NOTICE, CHAT_ID, update.message.reply_text, "\n".join(lines))
+    auto_delete_after(context, CHAT_ID, update.message.message_id, 30)
+    auto_delete_after(context, CHAT_ID, reply.message_id, 30)
 
 async def coolme(update, context):
     """Delete own post (POST_TOPIC_ID only)"""
@@ -524,7 +2416,7 @@ async def coolme(update, context):
         return
     
     user = update.effective_user
-    if user.id not in user_posts:
+    if not session_posts.msg_id(user.id):
         return
     
     kb = InlineKeyboardMarkup([[
@@ -532,10 +2424,10 @@ async def coolme(update, context):
         InlineKeyboardButton("No", callback_data="cancel")
     ]])
     
-    reply = await update.message.reply_text("Delete your post?", reply_markup=kb)
+    reply = await dispatch(LANE_NOTICE, CHAT_ID, update.message.reply_text, "Delete your post?", reply_markup=kb)
     
     # Auto-delete command
-    asyncio.create_task(auto_delete_after(context, CHAT_ID, update.message.message_id, 10))
+    auto_delete_after(context, CHAT_ID, update.message.message_id, 10)
 
 # ═══════════════════════════════════════════════════════════════
 # COMMAND HANDLERS - WORK EVERYWHERE
@@ -546,10 +2438,10 @@ async def pin(update, context):
         return
     
     if update.message.reply_to_message:
-        await context.bot.pin_chat_message(CHAT_ID, update.message.reply_to_message.message_id)
+        await dispatch(LANE_MODERATION, CHAT_ID, context.bot.pin_chat_message, CHAT_ID, update.message.reply_to_message.message_id)
     
     # Auto-delete command
-    asyncio.create_task(auto_delete_after(context, CHAT_ID, update.message.message_id, 10))
+    auto_delete_after(context, CHAT_ID, update.message.message_id, 10)
 
 async def unpin(update, context):
     """Unpin specific message"""
@@ -557,10 +2449,10 @@ async def unpin(update, context):
         return
     
     if update.message.reply_to_message:
-        await context.bot.unpin_chat_message(CHAT_ID, update.message.reply_to_message.message_id)
+        await dispatch(LANE_MODERATION, CHAT_ID, context.bot.unpin_chat_message, CHAT_ID, update.message.reply_to_message.message_id)
     
     # Auto-delete command
-    asyncio.create_task(auto_delete_after(context, CHAT_ID, update.message.message_id, 10))
+    auto_delete_after(context, CHAT_ID, update.message.message_id, 10)
 
 async def delete_msg(update, context):
     """Delete message"""
@@ -568,10 +2460,10 @@ async def delete_msg(update, context):
         return
     
     if update.message.reply_to_message:
-        await context.bot.delete_message(CHAT_ID, update.message.reply_to_message.message_id)
+        await dispatch(LANE_MODERATION, CHAT_ID, context.bot.delete_message, CHAT_ID, update.message.reply_to_message.message_id)
     
     # Auto-delete command
-    asyncio.create_task(auto_delete_after(context, CHAT_ID, update.message.message_id, 10))
+    auto_delete_after(context, CHAT_ID, update.message.message_id, 10)
 
 async def mute(update, context):
     """Mute user"""
@@ -580,9 +2472,9 @@ async def mute(update, context):
     
     user = await get_target_user(update, context)
     if not user:
-        reply = await update.message.reply_text("❌ User not found")
-        asyncio.create_task(auto_delete_after(context, CHAT_ID, update.message.message_id, 10))
-        asyncio.create_task(auto_delete_after(context, CHAT_ID, reply.message_id, 10))
+        reply = await dispatch(LANE_NOTICE, CHAT_ID, update.message.reply_text, "❌ User not found")
+        auto_delete_after(context, CHAT_ID, update.message.message_id, 10)
+        auto_delete_after(context, CHAT_ID, reply.message_id, 10)
         return
     
     # Get days (default 1)
@@ -593,7 +2485,8 @@ async def mute(update, context):
             break
     
     until = datetime.datetime.now() + datetime.timedelta(days=days)
-    await context.bot.restrict_chat_member(
+    await dispatch(
+        LANE_MODERATION, CHAT_ID, context.bot.restrict_chat_member,
         CHAT_ID, user.id,
         permissions=ChatPermissions(can_send_messages=False),
         until_date=until
@@ -603,7 +2496,7 @@ async def mute(update, context):
     await send_warn_msg(context.bot, f"🔕 User — {uname}\n\n>> Muted For {days} Days")
     
     # Auto-delete command
-    asyncio.create_task(auto_delete_after(context, CHAT_ID, update.message.message_id, 10))
+    auto_delete_after(context, CHAT_ID, update.message.message_id, 10)
 
 async def unmute(update, context):
     """Unmute user"""
@@ -612,12 +2505,13 @@ async def unmute(update, context):
     
     user = await get_target_user(update, context)
     if not user:
-        reply = await update.message.reply_text("❌ User not found")
-        asyncio.create_task(auto_delete_after(context, CHAT_ID, update.message.message_id, 10))
-        asyncio.create_task(auto_delete_after(context, CHAT_ID, reply.message_id, 10))
+        reply = await dispatch(LANE_NOTICE, CHAT_ID, update.message.reply_text, "❌ User not found")
+        auto_delete_after(context, CHAT_ID, update.message.message_id, 10)
+        auto_delete_after(context, CHAT_ID, reply.message_id, 10)
         return
     
-    await context.bot.restrict_chat_member(
+    await dispatch(
+        LANE_MODERATION, CHAT_ID, context.bot.restrict_chat_member,
         CHAT_ID, user.id,
         permissions=ChatPermissions(can_send_messages=True)
     )
@@ -626,7 +2520,7 @@ async def unmute(update, context):
     await send_warn_msg(context.bot, f"🔔 User — {uname}\n\n>> Unmuted")
     
     # Auto-delete command
-    asyncio.create_task(auto_delete_after(context, CHAT_ID, update.message.message_id, 10))
+    auto_delete_after(context, CHAT_ID, update.message.message_id, 10)
 
 async def warn(update, context):
     """Warn user"""
@@ -635,32 +2529,34 @@ async def warn(update, context):
     
     user = await get_target_user(update, context)
     if not user:
-        reply = await update.message.reply_text("❌ User not found")
-        asyncio.create_task(auto_delete_after(context, CHAT_ID, update.message.message_id, 10))
-        asyncio.create_task(auto_delete_after(context, CHAT_ID, reply.message_id, 10))
+        reply = await dispatch(LANE_NOTICE, CHAT_ID, update.message.reply_text, "❌ User not found")
+        auto_delete_after(context, CHAT_ID, update.message.message_id, 10)
+        auto_delete_after(context, CHAT_ID, reply.message_id, 10)
         return
     
     warnings[user.id] = warnings.get(user.id, 0) + 1
     wc = warnings[user.id]
+    store.put("warnings", user.id, wc)
     uname = f"@{user.username}" if user.username else user.full_name
     
     if wc == 2:
         until = datetime.datetime.now() + datetime.timedelta(days=1)
-        await context.bot.restrict_chat_member(
+        await dispatch(
+            LANE_MODERATION, CHAT_ID, context.bot.restrict_chat_member,
             CHAT_ID, user.id,
             permissions=ChatPermissions(can_send_messages=False),
             until_date=until
         )
         await send_warn_msg(context.bot, f"⚠️ User — {uname}\n\n>> Warned {wc}/4\n🔕 Muted For 1 Day")
     elif wc >= 4:
-        await context.bot.ban_chat_member(CHAT_ID, user.id)
-        await context.bot.unban_chat_member(CHAT_ID, user.id)
+        await dispatch(LANE_MODERATION, CHAT_ID, context.bot.ban_chat_member, CHAT_ID, user.id)
+        await dispatch(LANE_MODERATION, CHAT_ID, context.bot.unban_chat_member, CHAT_ID, user.id)
         await send_warn_msg(context.bot, f"🚫 User — {uname}\n\n>> Warned {wc}/4\n❌ Removed From Group")
     else:
         await send_warn_msg(context.bot, f"⚠️ User — {uname}\n\n>> Warning {wc}/4")
     
     # Auto-delete command
-    asyncio.create_task(auto_delete_after(context, CHAT_ID, update.message.message_id, 10))
+    auto_delete_after(context, CHAT_ID, update.message.message_id, 10)
 
 async def removewarn(update, context):
     """Remove warnings"""
@@ -669,17 +2565,18 @@ async def removewarn(update, context):
     
     user = await get_target_user(update, context)
     if not user:
-        reply = await update.message.reply_text("❌ User not found")
-        asyncio.create_task(auto_delete_after(context, CHAT_ID, update.message.message_id, 10))
-        asyncio.create_task(auto_delete_after(context, CHAT_ID, reply.message_id, 10))
+        reply = await dispatch(LANE_NOTICE, CHAT_ID, update.message.reply_text, "❌ User not found")
+        auto_delete_after(context, CHAT_ID, update.message.message_id, 10)
+        auto_delete_after(context, CHAT_ID, reply.message_id, 10)
         return
     
     warnings[user.id] = 0
+    store.put("warnings", user.id, 0)
     uname = f"@{user.username}" if user.username else user.full_name
     await send_warn_msg(context.bot, f"✅ User — {uname}\n\n>> Warnings Reset")
     
     # Auto-delete command
-    asyncio.create_task(auto_delete_after(context, CHAT_ID, update.message.message_id, 10))
+    auto_delete_after(context, CHAT_ID, update.message.message_id, 10)
 
 async def remove(update, context):
     """Remove user from group"""
@@ -688,19 +2585,19 @@ async def remove(update, context):
     
     user = await get_target_user(update, context)
     if not user:
-        reply = await update.message.reply_text("❌ User not found")
-        asyncio.create_task(auto_delete_after(context, CHAT_ID, update.message.message_id, 10))
-        asyncio.create_task(auto_delete_after(context, CHAT_ID, reply.message_id, 10))
+        reply = await dispatch(LANE_NOTICE, CHAT_ID, update.message.reply_text, "❌ User not found")
+        auto_delete_after(context, CHAT_ID, update.message.message_id, 10)
+        auto_delete_after(context, CHAT_ID, reply.message_id, 10)
         return
     
-    await context.bot.ban_chat_member(CHAT_ID, user.id)
-    await context.bot.unban_chat_member(CHAT_ID, user.id)
+    await dispatch(LANE_MODERATION, CHAT_ID, context.bot.ban_chat_member, CHAT_ID, user.id)
+    await dispatch(LANE_MODERATION, CHAT_ID, context.bot.unban_chat_member, CHAT_ID, user.id)
     
     uname = f"@{user.username}" if user.username else user.full_name
     await send_warn_msg(context.bot, f"👋 User — {uname}\n\n>> Removed From Group")
     
     # Auto-delete command
-    asyncio.create_task(auto_delete_after(context, CHAT_ID, update.message.message_id, 10))
+    auto_delete_after(context, CHAT_ID, update.message.message_id, 10)
 
 async def opentopic(update, context):
     """Open forum topic"""
@@ -708,10 +2605,10 @@ async def opentopic(update, context):
         return
     
     if update.message.message_thread_id:
-        await context.bot.reopen_forum_topic(CHAT_ID, update.message.message_thread_id)
+        await dispatch(LANE_MODERATION, CHAT_ID, context.bot.reopen_forum_topic, CHAT_ID, update.message.message_thread_id)
     
     # Auto-delete command
-    asyncio.create_task(auto_delete_after(context, CHAT_ID, update.message.message_id, 10))
+    auto_delete_after(context, CHAT_ID, update.message.message_id, 10)
 
 async def closetopic(update, context):
     """Close forum topic"""
@@ -719,10 +2616,10 @@ async def closetopic(update, context):
         return
     
     if update.message.message_thread_id:
-        await context.bot.close_forum_topic(CHAT_ID, update.message.message_thread_id)
+        await dispatch(LANE_MODERATION, CHAT_ID, context.bot.close_forum_topic, CHAT_ID, update.message.message_thread_id)
     
     # Auto-delete command
-    asyncio.create_task(auto_delete_after(context, CHAT_ID, update.message.message_id, 10))
+    auto_delete_after(context, CHAT_ID, update.message.message_id, 10)
 
 async def clear_topic(update, context):
     """Clear topic messages"""
@@ -730,19 +2627,15 @@ async def clear_topic(update, context):
         return
     
     tid = update.message.message_thread_id
-    ids = topic_messages.get(tid, []).copy()
+    ids = clear_jobs.setdefault(tid, array("q"))
+    ids.extend(topic_messages.pop(tid, ()))
     ids.append(update.message.message_id)
+    save_clear_jobs()
     
-    deleted = 0
-    for mid in ids:
-        try:
-            await context.bot.delete_message(CHAT_ID, mid)
-            deleted += 1
-            await asyncio.sleep(0.05)
-        except:
-            pass
-    
-    topic_messages[tid] = []
+    # A running purge picks up the new ids; otherwise start one in the background
+    task = clear_tasks.get(tid)
+    if task is None or task.done():
+        clear_tasks[tid] = asyncio.ensure_future(purge_topic(context.bot, tid))
 
 async def topicid(update, context):
     """Show topic ID"""
@@ -750,11 +2643,49 @@ async def topicid(update, context):
         return
     
     tid = update.message.message_thread_id
-    reply = await update.message.reply_text(f"📌 Topic ID: `{tid}`", parse_mode="Markdown")
+    reply = await dispatch(LANE_NOTICE, CHAT_ID, update.message.reply_text, f"📌 Topic ID: `{tid}`", parse_mode="Markdown")
     
     # Auto-delete after 30 seconds
-    asyncio.create_task(auto_delete_after(context, CHAT_ID, update.message.message_id, 30))
-    asyncio.create_task(auto_delete_after(context, CHAT_ID, reply.message_id, 30))
+    auto_delete_after(context, CHAT_ID, update.message.message_id, 30)
+    auto_delete_after(context, CHAT_ID, reply.message_id, 30)
+
+async def metrics_cmd(update, context):
+    """Latency/error summary of handlers, jobs and API calls"""
+    if not await is_admin(update, context):
+        return
+    
+    lines = metrics.summary() or ["No calls recorded yet"]
+    reply = await dispatch(LANE_NOTICE, CHAT_ID, update.message.reply_text, "📈 Metrics (busiest first)\n\n" + "\n".join(lines))
+    
+    auto_delete_after(context, CHAT_ID, update.message.message_id, 30)
+    auto_delete_after(context, CHAT_ID, reply.message_id, 60)
+
+async def profile_cmd(update, context):
+    """Toggle CPU profiling: /profile [seconds]"""
+    if not await is_admin(update, context):
+        return
+    
+    seconds = int(context.args[0]) if (context.args and context.args[0].isdigit()) else 0
+    text = await toggle_profile(context.bot, seconds)
+    reply = await dispatch(LANE_NOTICE, CHAT_ID, update.message.reply_text, text)
+    
+    auto_delete_after(context, CHAT_ID, update.message.message_id, 10)
+    auto_delete_after(context, CHAT_ID, reply.message_id, 30)
+
+async def memsnap(update, context):
+    """Memory snapshot diff: /memsnap, or /memsnap stop"""
+    if not await is_admin(update, context):
+        return
+    
+    if context.args and context.args[0] == "stop":
+        profiler.mem_stop()
+        text = "🧠 Memory tracing stopped"
+    else:
+        text = await memory_snapshot(context.bot)
+    reply = await dispatch(LANE_NOTICE, CHAT_ID, update.message.reply_text, text)
+    
+    auto_delete_after(context, CHAT_ID, update.message.message_id, 10)
+    auto_delete_after(context, CHAT_ID, reply.message_id, 30)
 
 async def setsession(update, context):
     """Session settings dashboard"""
@@ -764,7 +2695,7 @@ async def setsession(update, context):
         [InlineKeyboardButton("Stats", callback_data="stats")],
         [InlineKeyboardButton("Streaks", callback_data="streaks")],
     ]
-    await update.message.reply_text("⚙ Dashboard", reply_markup=InlineKeyboardMarkup(kb))
+    await dispatch(LANE_NOTICE, CHAT_ID, update.message.reply_text, "⚙ Dashboard", reply_markup=InlineKeyboardMarkup(kb))
 
 # ═══════════════════════════════════════════════════════════════
 # MESSAGE HANDLER
@@ -777,7 +2708,7 @@ async def handle_message(update, context):
         return
     
     if not session_open:
-        await update.message.delete()
+        await dispatch(LANE_MODERATION, CHAT_ID, update.message.delete)
         return
     
     text = update.message.text or ""
@@ -785,73 +2716,68 @@ async def handle_message(update, context):
     _cache_user(user)
     track_msg(update.message.message_thread_id, update.message.message_id)
     
-    if "http" not in text:
+    link = parse_link(text)
+    if not link:
         return
     
-    if user.id in user_posts:
-        await update.message.delete()
+    # Posts are reserved before the first await below, so this also covers posts still being sent
+    if user.id in session_posts.by_poster:
+        await dispatch(LANE_MODERATION, CHAT_ID, update.message.delete)
         return
     
-    if text in posted_links:
-        await update.message.delete()
+    if link.key in session_posts.by_key:
+        await dispatch(LANE_MODERATION, CHAT_ID, update.message.delete)
         return
     
-    # Check for @i username
-    if "x.com/i/" in text or "/i/" in text:
-        await update.message.delete()
-        sent = await context.bot.send_message(
+    # Check for @i username (or an X link that names no account at all)
+    if link.handle == "i" or (link.handle is None and X_HOST_RE.match(link.host)):
+        await dispatch(LANE_MODERATION, CHAT_ID, update.message.delete)
+        sent = await dispatch(
+            LANE_NOTICE, CHAT_ID, context.bot.send_message,
             chat_id=CHAT_ID,
             message_thread_id=POST_TOPIC_ID,
             text=f"⟡ Hey {user.full_name}\n\nPlease Replace The @i With Your Real X Username\n\nThank You 😊"
         )
-        asyncio.create_task(auto_delete_after(context, CHAT_ID, sent.message_id, 30))
+        auto_delete_after(context, CHAT_ID, sent.message_id, 30)
         return
     
-    # Process valid post
-    posted_links.add(text)
+    # Process valid post - everything up to the first await reserves the post atomically
+    prev_streak = (user_streaks.get(user.id), user_last_session.get(user.id))
     update_streak(user.id)
-    session_members.add(user.id)
     
     streak = user_streaks.get(user.id, 1)
     s_emoji = f" {streak_emoji(streak)}" if streak >= 3 else ""
     
-    # Extract X username
-    x_username = "Unknown"
-    try:
-        if "x.com" in text:
-            x_username = text.split("/")[3]
-    except:
-        pass
+    x_username = link.handle or "Unknown"
     
     post_num = counter
-    session_links[post_num] = {
-        "url": text,
-        "poster_id": user.id,
-        "x_username": x_username
-    }
+    counter += 1
+    store.put("kv", "counter", counter)
+    reservation = session_posts.add(post_num, user.id, link, x_username)
     
     # Format message
-    formatted = f"Post - {post_num}\n𖣯 Name - {user.full_name}{s_emoji}\n𖣯 X - @{x_username}\n‣ {text}"
-    
-    await update.message.delete()
-    
-    # Create tracking URL
-    track_url = f"{SERVER_URL}/track?uid={user.id}&post={post_num}&sess={session_number}&x={quote(x_username)}&link={quote(text)}"
+    formatted = f"Post - {post_num}\n𖣯 Name - {user.full_name}{s_emoji}\n𖣯 X - @{x_username}\n‣ {link.url}"
     
-    keyboard = InlineKeyboardMarkup([[
-        InlineKeyboardButton("✅ Visit & Engage", url=track_url)
-    ]])
+    keyboard = InlineKeyboardMarkup([[engage_button(post_num, link, x_username, user.id)]])
     
-    sent = await context.bot.send_message(
-        chat_id=CHAT_ID,
-        message_thread_id=POST_TOPIC_ID,
-        text=formatted,
-        reply_markup=keyboard
+    # Repost and delete the original in parallel - one round-trip per post
+    sent, _ = await asyncio.gather(
+        dispatch(
+            LANE_POST, CHAT_ID, context.bot.send_message,
+            chat_id=CHAT_ID,
+            message_thread_id=POST_TOPIC_ID,
+            text=formatted,
+            reply_markup=keyboard
+        ),
+        dispatch(LANE_MODERATION, CHAT_ID, update.message.delete),
+        return_exceptions=True
     )
+    if isinstance(sent, BaseException):
+        rollback_post(reservation, prev_streak)
+        return
     
-    user_posts[user.id] = sent.message_id
+    session_posts.sent_as(reservation, sent.message_id)
     track_msg(POST_TOPIC_ID, sent.message_id)
-    counter += 1
 
 # ═══════════════════════════════════════════════════════════════
 # BUTTON HANDLERS
@@ -863,13 +2789,14 @@ async def button_handler(update, context):
     
     if query.data.startswith("delete_"):
         uid = int(query.data.split("_")[1])
-        if uid in user_posts:
-            await context.bot.delete_message(CHAT_ID, user_posts[uid])
-            del user_posts[uid]
-            await query.edit_message_text("✅ Post deleted")
+        msg_id = session_posts.msg_id(uid)
+        if msg_id:
+            await dispatch(LANE_MODERATION, CHAT_ID, context.bot.delete_message, CHAT_ID, msg_id)
+            session_posts.remove(uid)
+            await dispatch(LANE_NOTICE, CHAT_ID, query.edit_message_text, "✅ Post deleted")
     
     elif query.data == "cancel":
-        await query.edit_message_text("❌ Cancelled")
+        await dispatch(LANE_NOTICE, CHAT_ID, query.edit_message_text, "❌ Cancelled")
 
 async def dashboard_buttons(update, context):
     """Handle dashboard button callbacks"""
@@ -879,38 +2806,58 @@ async def dashboard_buttons(update, context):
     
     if query.data == "view_times":
         timings = timing_text_ist()
-        await query.edit_message_text(f"📅 Session Times (IST):\n\n• {timings}")
+        await dispatch(LANE_NOTICE, CHAT_ID, query.edit_message_text, f"📅 Session Times (IST):\n\n• {timings}")
     
     elif query.data == "toggle_auto":
         auto_sessions_enabled = not auto_sessions_enabled
-        await query.edit_message_text(f"🤖 Auto Sessions: {'✅ ON' if auto_sessions_enabled else '❌ OFF'}")
+        save_kv()
+        await dispatch(LANE_NOTICE, CHAT_ID, query.edit_message_text, f"🤖 Auto Sessions: {'✅ ON' if auto_sessions_enabled else '❌ OFF'}")
     
     elif query.data == "stats":
-        await query.edit_message_text(
+        m = dispatcher.metrics()
+        uc = user_cache.stats()
+        queued = sum(m[name]["queued"] for name in LANE_NAMES.values())
+        await dispatch(
+            LANE_NOTICE, CHAT_ID, query.edit_message_text,
             f"📊 Current Stats:\n\n"
             f"Session: {session_number}\n"
-            f"Posts: {len(user_posts)}\n"
-            f"Threshold: {ENGAGE_THRESHOLD}%"
+            f"Posts: {session_posts.sent}\n"
+            f"Threshold: {ENGAGE_THRESHOLD}%\n"
+            f"User Cache: {uc['size']} (hits {uc['hits']}, misses {uc['misses']}, evicted {uc['evictions']})\n\n"
+            f"📤 Outbound Queue: {queued} (in flight {m['inflight']})\n"
+            + "\n".join(
+                f"• {name}: {m[name]['sent']} sent, {m[name]['failed']} failed, "
+                f"avg wait {m[name]['wait_avg']:.2f}s, max {m[name]['wait_max']:.2f}s"
+                for name in LANE_NAMES.values()
+            )
         )
     
     elif query.data == "streaks":
         if not user_streaks:
-            await query.edit_message_text("No streak data yet")
+            await dispatch(LANE_NOTICE, CHAT_ID, query.edit_message_text, "No streak data yet")
             return
         
-        top = sorted(user_streaks.items(), key=lambda x: x[1], reverse=True)[:10]
+        top = streak_index.top(LEADERBOARD_SIZE)
+        names = await resolve_names(context.bot, [uid for uid, _ in top])
         lines = ["🔥 Top Streaks\n"]
         
         for rank, (uid, s) in enumerate(top, 1):
             e = streak_emoji(s)
-            try:
-                m = await context.bot.get_chat_member(CHAT_ID, uid)
-                name = f"@{m.user.username}" if m.user.username else m.user.full_name
-            except:
-                name = f"User{uid}"
-            lines.append(f"{rank}. {name} — {s} {e}")
+            lines.append(f"{rank}. {names[uid]} — {s} {e}")
         
-        await query.edit_message_text("\n".join(lines))
+        await dispatch(LANE_NOTICE, CHAT_ID, query.edit_message_text, "\n".join(lines))
+
+async def track_admin_changes(update, context):
+    """Invalidate admin cache on promotion or demotion"""
+    cmu = update.chat_member
+    if not cmu:
+        return
+    _cache_user(cmu.new_chat_member.user)
+    admin_states = ("administrator", "creator")
+    was = cmu.old_chat_member.status in admin_states
+    now = cmu.new_chat_member.status in admin_states
+    if was or now:
+        invalidate_admins(cmu.chat.id)
 
 async def cache_new_member(update, context):
     """Cache new members"""
@@ -921,7 +2868,150 @@ async def cache_new_member(update, context):
 # ═══════════════════════════════════════════════════════════════
 # SETUP & START
 # ═══════════════════════════════════════════════════════════════
-app = ApplicationBuilder().token(TOKEN).build()
+class UpdateRecorder:
+    """Buffers incoming updates and appends them to a gzipped JSONL log in the background"""
+    
+    def __init__(self, path):
+        self.path = path
+        self.buf = []
+        self.task = None
+    
+    def append(self, update):
+        self.buf.append((time.time(), update))
+    
+    def _encode(self):
+        buf, self.buf = self.buf, []
+        return "".join(json.dumps({"t": t, "u": u.to_dict()}, separators=(",", ":")) + "\n" for t, u in buf)
+    
+    def _write(self, text):
+        # Each flush is its own gzip member; readers see one continuous stream
+        with gzip.open(self.path, "at", encoding="utf-8") as f:
+            f.write(text)
+    
+    def flush(self):
+        if self.path and self.buf:
+            self._write(self._encode())
+    
+    def start(self):
+        if self.path and (self.task is None or self.task.done()):
+            self.task = asyncio.ensure_future(self._run())
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(RECORD_FLUSH_INTERVAL)
+            if not self.buf:
+                continue
+            try:
+                await asyncio.to_thread(self._write, self._encode())
+            except OSError as e:
+                print(f"⚠️ Update log flush failed: {e}")
+
+recorder = UpdateRecorder(RECORD_FILE)
+
+class UpdateQueue(asyncio.Queue):
+    """Update queue that hands out at most `inflight` updates not yet marked done"""
+    
+    def __init__(self, maxsize, inflight):
+        super().__init__(maxsize)
+        self.inflight = inflight
+        self.taken = 0
+        self.slot_free = asyncio.Event()
+    
+    async def get(self):
+        # Leave updates queued while the handlers are saturated so the bound applies upstream
+        while self.taken >= self.inflight:
+            self.slot_free.clear()
+            await self.slot_free.wait()
+        return await super().get()
+    
+    def get_nowait(self):
+        item = super().get_nowait()
+        self.taken += 1
+        return item
+    
+    def task_done(self):
+        super().task_done()
+        self.taken -= 1
+        self.slot_free.set()
+    
+    def park(self):
+        """An update started waiting behind its user - free its slot meanwhile"""
+        self.taken -= 1
+        self.slot_free.set()
+    
+    def unpark(self):
+        self.taken += 1
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Process updates concurrently, but one at a time per user"""
+    
+    def __init__(self, max_concurrent_updates, queue=None, backlog=USER_BACKLOG):
+        # PTB's semaphore must never block here: the queue bounds updates in flight,
+        # the backlog bounds the ones parked behind their user, and running ones are bounded below
+        super().__init__(sys.maxsize)
+        self.running = asyncio.Semaphore(max_concurrent_updates)
+        self.queue = queue
+        self.backlog = backlog
+        self.locks = {}
+        self.waiting = {}
+    
+    async def do_process_update(self, update, coroutine):
+        if RECORD_FILE:
+            recorder.append(update)
+        user = getattr(update, "effective_user", None)
+        chat = getattr(update, "effective_chat", None)
+        key = user.id if user else (chat.id if chat else None)
+        if key is None:
+            async with self.running:
+                await coroutine
+            return
+        
+        waiting = self.waiting.get(key, 0)
+        if waiting > self.backlog:
+            # A flood from one user; drop rather than hold memory and slots for it
+            coroutine.close()
+            metrics.count(("update", "per_user"), "Dropped")
+            return
+        lock = self.locks.get(key)
+        if lock is None:
+            lock = self.locks[key] = asyncio.Lock()
+        self.waiting[key] = waiting + 1
+        # Waiting behind the same user takes neither an in-flight nor a running slot
+        parked = self.queue is not None and waiting > 0
+        if parked:
+            self.queue.park()
+        try:
+            async with lock:
+                if parked:
+                    self.queue.unpark()
+                    parked = False
+                async with self.running:
+                    await coroutine
+        finally:
+            if parked:
+                self.queue.unpark()
+            self.waiting[key] -= 1
+            if not self.waiting[key]:
+                del self.waiting[key]
+                del self.locks[key]
+    
+    async def initialize(self):
+        pass
+    
+    async def shutdown(self):
+        pass
+
+update_queue = UpdateQueue(UPDATE_QUEUE_SIZE, UPDATE_INFLIGHT)
+app = (
+    ApplicationBuilder()
+    .token(TOKEN)
+    .base_url(BOT_API_URL)
+    .request(InstrumentedRequest(connection_pool_size=256))
+    .get_updates_request(InstrumentedRequest(connection_pool_size=1))
+    .update_queue(update_queue)
+    .concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES, update_queue))
+    .build()
+)
 
 # Register all command handlers
 commands = [
@@ -930,6 +3020,7 @@ commands = [
     ("endsession", endsession),
     ("report", report_cmd),
     ("coolme", coolme),
+    ("progress", progress_cmd),
     
     # Work everywhere
     ("pin", pin),
@@ -945,18 +3036,22 @@ commands = [
     ("clear", clear_topic),
     ("topicid", topicid),
     ("setsession", setsession),
+    ("metrics", metrics_cmd),
+    ("profile", profile_cmd),
+    ("memsnap", memsnap),
 ]
 
 for cmd, fn in commands:
-    app.add_handler(CommandHandler(cmd, fn))
+    app.add_handler(CommandHandler(cmd, instrument("handler", fn, cmd)))
 
 # Register message handlers
-app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-app.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, cache_new_member))
+app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, instrument("handler", handle_message)))
+app.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, instrument("handler", cache_new_member)))
+app.add_handler(ChatMemberHandler(instrument("handler", track_admin_changes), ChatMemberHandler.CHAT_MEMBER))
 
 # Register callback handlers
-app.add_handler(CallbackQueryHandler(button_handler, pattern="^(delete_|cancel)"))
-app.add_handler(CallbackQueryHandler(dashboard_buttons, pattern="^(view_times|toggle_auto|stats|streaks)$"))
+app.add_handler(CallbackQueryHandler(instrument("handler", button_handler), pattern="^(delete_|cancel)"))
+app.add_handler(CallbackQueryHandler(instrument("handler", dashboard_buttons), pattern="^(view_times|toggle_auto|stats|streaks)$"))
 
 # ═══════════════════════════════════════════════════════════════
 # SCHEDULER SETUP WITH PROPER SESSION MAPPING
@@ -970,6 +3065,11 @@ def make_auto_open(sess_num):
         await auto_open(sess_num)
     return job
 
+def make_report(sess_num):
+    async def job():
+        await scheduled_report(sess_num)
+    return job
+
 def make_notify_10min(next_sess):
     async def job():
         await notify_10min(next_sess)
@@ -992,21 +3092,141 @@ for idx, sched in enumerate(SCHEDULE_IST):
     next_session = SESSION_NUMBERS[(idx + 1) % 4]  # Wrap around after session 4
     
     # Pass session numbers properly using wrapper functions
-    scheduler.add_job(make_auto_open(current_session), "cron", hour=oh, minute=om, id=f"open_{idx}")
-    scheduler.add_job(auto_close, "cron", hour=ch, minute=cm, id=f"close_{idx}")
-    scheduler.add_job(pre_check, "cron", hour=ckh, minute=ckm, id=f"check_{idx}")
-    scheduler.add_job(generate_report, "cron", hour=rh, minute=rm, id=f"rep_{idx}")
-    scheduler.add_job(make_notify_10min(next_session), "cron", hour=n10h, minute=n10m, id=f"n10_{idx}")
-    scheduler.add_job(make_notify_5min(next_session), "cron", hour=n5h, minute=n5m, id=f"n5_{idx}")
+    scheduler.add_job(instrument("job", make_auto_open(current_session), "auto_open"), "cron", hour=oh, minute=om, id=f"open_{idx}")
+    scheduler.add_job(instrument("job", auto_close), "cron", hour=ch, minute=cm, id=f"close_{idx}")
+    scheduler.add_job(instrument("job", pre_check), "cron", hour=ckh, minute=ckm, id=f"check_{idx}")
+    scheduler.add_job(instrument("job", make_report(current_session), "generate_report"), "cron", hour=rh, minute=rm, id=f"rep_{idx}")
+    scheduler.add_job(instrument("job", make_notify_10min(next_session), "notify_10min"), "cron", hour=n10h, minute=n10m, id=f"n10_{idx}")
+    scheduler.add_job(instrument("job", make_notify_5min(next_session), "notify_5min"), "cron", hour=n5h, minute=n5m, id=f"n5_{idx}")
+
+scheduler.add_job(instrument("job", poll_clicks), "interval", seconds=CLICK_POLL_INTERVAL, id="click_poll", max_instances=1, coalesce=True)
+
+def record_lateness(event):
+    """Scheduler listener: how late each job started (event-loop starvation), and misses"""
+    key = ("lateness", event.job_id)
+    if event.code == EVENT_JOB_MISSED:
+        metrics.count(key, "Missed")
+        print(f"⚠️ Job {event.job_id} missed its {event.scheduled_run_time} run")
+        return
+    metrics.observe(key, max(0.0, time.time() - max(event.scheduled_run_times).timestamp()))
+
+scheduler.add_listener(record_lateness, EVENT_JOB_SUBMITTED | EVENT_JOB_MISSED)
 
 async def start_scheduler(application):
     """Initialize scheduler"""
-    global bot_instance
+    global bot_instance, ingest_session
     bot_instance = application.bot
-    scheduler.start()
+    get_http()
+    t = time.perf_counter()
+    load_state()
+    store.start()
+    if store.db:
+        print(f"✅ State restored in {time.perf_counter() - t:.3f}s")
+    if session_posts:
+        # Keep the index (and the click log) of the session in progress
+        ingest_session = session_number
+    if TRACK_PUBLIC_URL:
+        await start_tracker()
+    delete_scheduler.restore(application.bot)
+    restore_clear_jobs(application.bot)
+    recorder.start()
+    if METRICS_PORT:
+        await start_metrics_server()
+    if hasattr(signal, "SIGUSR1"):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGUSR1, signal.SIGUSR2):
+            loop.add_signal_handler(sig, on_profile_signal, sig)
+    # Catch up in the background so updates flow meanwhile; cron jobs start after it
+    asyncio.ensure_future(resume_schedule())
+
+async def resume_schedule():
+    """Run any skipped session stage, then let the cron jobs fire"""
+    # Started paused so cron times passing during a long catch-up fire late (or are reported missed)
+    scheduler.start(paused=True)
+    try:
+        await catch_up_schedule()
+    except Exception as e:
+        print(f"⚠️ Schedule catch-up failed: {type(e).__name__}: {e}")
+    scheduler.resume()
     print("✅ Scheduler started - Auto sessions enabled")
 
+async def on_shutdown(application):
+    """Flush pending state and close clients on shutdown"""
+    await store.stop()
+    click_log.flush()
+    recorder.flush()
+    if tracker_runner:
+        await tracker_runner.cleanup()
+    if metrics_runner:
+        await metrics_runner.cleanup()
+    if http_session:
+        await http_session.close()
+
 app.post_init = start_scheduler
+app.post_shutdown = on_shutdown
+
+# ═══════════════════════════════════════════════════════════════
+# WEBHOOK INGESTION
+# ═══════════════════════════════════════════════════════════════
+async def webhook_handler(request):
+    """Verify and enqueue one update POSTed by Telegram"""
+    token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not hmac.compare_digest(token.encode(), WEBHOOK_SECRET.encode()):
+        return web.Response(status=403)
+    try:
+        data = await request.json()
+        if not isinstance(data, dict):
+            return web.Response(status=400)
+        update = Update.de_json(data, app.bot)
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return web.Response(status=400)
+    
+    # Bounded queue: when full, make Telegram back off and redeliver
+    try:
+        await asyncio.wait_for(app.update_queue.put(update), WEBHOOK_PUT_TIMEOUT)
+    except asyncio.TimeoutError:
+        return web.Response(status=503)
+    return web.Response()
+
+def build_webhook_app():
+    """aiohttp app serving the webhook endpoint"""
+    web_app = web.Application()
+    web_app.router.add_post(WEBHOOK_PATH, webhook_handler)
+    return web_app
+
+async def run_webhook():
+    """Serve updates over a local webhook listener instead of polling"""
+    if not WEBHOOK_SECRET:
+        # Without it anyone who finds the listener can inject updates
+        print("❌ BOT_MODE=webhook requires WEBHOOK_SECRET")
+        raise SystemExit(1)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    
+    await app.initialize()
+    await app.post_init(app)
+    if WEBHOOK_URL:
+        await app.bot.set_webhook(
+            url=WEBHOOK_URL + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES
+        )
+    
+    runner = web.AppRunner(build_webhook_app())
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_LISTEN, WEBHOOK_PORT).start()
+    await app.start()
+    print(f"✅ Webhook listening on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+        await app.stop()
+        await app.post_shutdown(app)
+        await app.shutdown()
 
 if __name__ == "__main__":
     print("🚀 Telegram Engagement Bot Starting...")
@@ -1014,4 +3234,7 @@ if __name__ == "__main__":
     print(f"🔢 Sessions: {MAX_SESSION_NUM}")
     print(f"📅 Session Mapping: 11AM=1, 4PM=2, 8PM=3, 12AM=4")
     print("✅ All systems ready!")
-    app.run_polling()
+    if BOT_MODE == "webhook":
+        asyncio.run(run_webhook())
+    else:
+        app.run_polling(allowed_updates=Update.ALL_TYPES)